@@ -0,0 +1,355 @@
+# app/bench.py
+# End-to-end load benchmark over the real routers, in process:
+#   python -m app.bench --orders 1000000 --concurrency 64 --duration 30 --output bench.json
+#   python -m app.bench --no-seed --baseline bench.json
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+DEFAULT_MIX = "login=2,menu=60,cart_add=12,create_order=8,list_orders=12,admin_status=3,delivery_status=3"
+BENCH_PASSWORD = "bench-password"
+DELIVERY_PARTNER_ID = 2
+# Seeded order statuses by order_id % 10: most history is delivered, the
+# rest is spread over the states the status routes can still move.
+SEED_STATUSES = ["PLACED", "PREPARING", "READY_FOR_PICKUP", "OUT_FOR_DELIVERY"] + ["DELIVERED"] * 6
+# (current status, next status) each status route walks orders through.
+ADMIN_MOVES = [("PLACED", "preparing"), ("PREPARING", "ready_for_pickup")]
+DELIVERY_MOVES = [("READY_FOR_PICKUP", "out_for_delivery"), ("OUT_FOR_DELIVERY", "delivered")]
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight)
+    return mix
+
+
+def seed(path: str, *, users: int, pizzas: int, orders: int, items_per_order: int, password_hash: str) -> None:
+    # Raw executemany keeps seeding millions of orders to minutes; the schema
+    # itself comes from the app's own metadata via startup.migrate().
+    random.seed(1)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    with conn:
+        conn.execute("DELETE FROM order_items")
+        conn.execute("DELETE FROM orders")
+        conn.execute("DELETE FROM cart_items")
+        conn.execute("DELETE FROM pizzas")
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM sales_daily_pizza")
+        conn.execute("DELETE FROM orders_daily_status")
+        conn.executemany(
+            "INSERT INTO users (id, username, email, hashed_password, role, is_active, token_version)"
+            " VALUES (?, ?, ?, ?, ?, 1, 0)",
+            [
+                (i, f"user{i}", f"user{i}@bench.local", password_hash,
+                 "ADMIN" if i == 1 else "DELIVERY_PARTNER" if i == 2 else "CUSTOMER")
+                for i in range(1, users + 1)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO pizzas (id, name, description, price, is_available) VALUES (?, ?, ?, ?, 1)",
+            [(i, f"Pizza {i}", "Benchmark pizza", round(random.uniform(6, 25), 2)) for i in range(1, pizzas + 1)],
+        )
+
+    start = datetime.utcnow() - timedelta(days=365)
+    item_id = 1
+    chunk = 10_000
+    for first in range(1, orders + 1, chunk):
+        order_rows, item_rows = [], []
+        for order_id in range(first, min(first + chunk, orders + 1)):
+            created_at = start + timedelta(seconds=order_id * 365 * 86400 // max(orders, 1))
+            total = 0.0
+            for _ in range(items_per_order):
+                pizza_id = random.randint(1, pizzas)
+                quantity = random.randint(1, 3)
+                price = 10.0
+                item_rows.append((item_id, order_id, pizza_id, quantity, price))
+                total += quantity * price
+                item_id += 1
+            status = SEED_STATUSES[order_id % len(SEED_STATUSES)]
+            # Orders past the kitchen belong to the bench delivery partner.
+            partner_id = DELIVERY_PARTNER_ID if status in ("READY_FOR_PICKUP", "OUT_FOR_DELIVERY") else None
+            order_rows.append((order_id, random.randint(3, users), total, status, created_at, created_at, partner_id))
+        with conn:
+            conn.executemany(
+                "INSERT INTO orders (id, user_id, total_amount, status, created_at, updated_at, assigned_partner_id)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                order_rows,
+            )
+            conn.executemany(
+                "INSERT INTO order_items (id, order_id, pizza_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)",
+                item_rows,
+            )
+    conn.close()
+
+
+def load_active_orders(path: str, *, limit: int) -> Dict[str, List[int]]:
+    # Orders each status route can legally move, read back from the DB so a
+    # --no-seed run picks up wherever the previous run left them.
+    conn = sqlite3.connect(path)
+    try:
+        active = {}
+        for moves, partner_id in ((ADMIN_MOVES, None), (DELIVERY_MOVES, DELIVERY_PARTNER_ID)):
+            for status, _ in moves:
+                rows = conn.execute(
+                    "SELECT id FROM orders WHERE status = ? AND assigned_partner_id IS ? LIMIT ?",
+                    (status, partner_id, limit),
+                )
+                active[status] = [order_id for order_id, in rows]
+        return active
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile.
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Workload:
+    def __init__(self, client, args, tokens: Dict[int, str], active: Dict[str, List[int]]):
+        self.client = client
+        self.args = args
+        self.tokens = tokens
+        self.active = active
+        self.customer_ids = [user_id for user_id in tokens if user_id > DELIVERY_PARTNER_ID]
+
+    def _auth(self, user_id: int) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def _customer(self) -> int:
+        return random.choice(self.customer_ids)
+
+    def _take_order(self, moves: List[Tuple[str, str]]) -> Tuple[int, str]:
+        # Takes an order out of a pool so no two workers move the same one;
+        # only a drained pool falls back to a random (likely 409) order.
+        status, next_status = random.choice(moves)
+        pool = self.active[status]
+        if not pool:
+            return random.randint(1, max(self.args.orders, 1)), next_status
+        index = random.randrange(len(pool))
+        pool[index], pool[-1] = pool[-1], pool[index]
+        return pool.pop(), next_status
+
+    def _moved(self, response, order_id: int, moves: List[Tuple[str, str]]) -> None:
+        # A moved order joins the pool of its new status when the same route
+        # can move it again (admin-readied orders aren't assigned to partner 2).
+        if response.status_code != 200:
+            return
+        status = response.json()["status"].upper()
+        if any(status == source for source, _ in moves):
+            self.active[status].append(order_id)
+
+    async def login(self):
+        user_id = self._customer()
+        return await self.client.post(
+            "/token", data={"username": f"user{user_id}", "password": BENCH_PASSWORD}
+        )
+
+    async def menu(self):
+        return await self.client.get("/customer/pizzas", headers=self._auth(self._customer()))
+
+    async def cart_add(self):
+        return await self.client.post(
+            "/customer/cart/add",
+            json={"pizza_id": random.randint(1, self.args.pizzas), "quantity": 1},
+            headers=self._auth(self._customer()),
+        )
+
+    async def create_order(self):
+        user_id = self._customer()
+        items = [
+            {"pizza_id": random.randint(1, self.args.pizzas), "quantity": random.randint(1, 3)}
+            for _ in range(random.randint(1, 4))
+        ]
+        response = await self.client.post(
+            "/customer/orders", json={"user_id": user_id, "items": items}, headers=self._auth(user_id)
+        )
+        if response.status_code == 200:
+            self.active["PLACED"].append(response.json()["id"])
+        return response
+
+    async def list_orders(self):
+        return await self.client.get("/customer/orders?limit=20", headers=self._auth(self._customer()))
+
+    async def admin_status(self):
+        order_id, next_status = self._take_order(ADMIN_MOVES)
+        response = await self.client.put(
+            f"/admin/orders/{order_id}/status", json={"status": next_status}, headers=self._auth(1)
+        )
+        self._moved(response, order_id, ADMIN_MOVES)
+        return response
+
+    async def delivery_status(self):
+        order_id, next_status = self._take_order(DELIVERY_MOVES)
+        response = await self.client.put(
+            f"/delivery/orders/{order_id}/status", json={"status": next_status},
+            headers=self._auth(DELIVERY_PARTNER_ID),
+        )
+        self._moved(response, order_id, DELIVERY_MOVES)
+        return response
+
+
+async def drive(app, args, tokens: Dict[int, str], active: Dict[str, List[int]]) -> Dict:
+    import httpx
+
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    conflicts: Dict[str, int] = defaultdict(int)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        workload = Workload(client, args, tokens, active)
+        deadline = time.perf_counter() + args.duration
+        remaining = [args.requests or float("inf")]
+
+        async def worker():
+            while time.perf_counter() < deadline and remaining[0] > 0:
+                remaining[0] -= 1
+                name = random.choices(names, weights)[0]
+                started = time.perf_counter()
+                response = await getattr(workload, name)()
+                latencies[name].append(time.perf_counter() - started)
+                if response.status_code == 409:
+                    # Status moves once a pool of movable orders ran dry.
+                    conflicts[name] += 1
+                elif response.status_code >= 400:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    routes = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        routes[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "conflicts": conflicts[name],
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "throughput_rps": len(values) / elapsed,
+        }
+    total = sum(route["count"] for route in routes.values())
+    return {
+        "config": {
+            key: getattr(args, key)
+            for key in ("users", "pizzas", "orders", "items_per_order", "concurrency", "duration", "requests", "mix")
+        },
+        "started_at": datetime.utcnow().isoformat(),
+        "elapsed_seconds": elapsed,
+        "total_requests": total,
+        "throughput_rps": total / elapsed,
+        "routes": routes,
+    }
+
+
+def compare(result: Dict, baseline: Dict, max_regression: float) -> bool:
+    ok = True
+    print(f"{'route':<16}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, current in result["routes"].items():
+        previous = baseline.get("routes", {}).get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in (
+            ("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("throughput_rps", True)
+        ):
+            before, after = previous[metric], current[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            regressed = change < -max_regression if higher_is_better else change > max_regression
+            ok &= not regressed
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:<16}{metric:<16}{before:>12.2f}{after:>12.2f}{change:>9.1f}%{flag}")
+    return ok
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.bench")
+    parser.add_argument("--db", default="./bench.db")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--pizzas", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--no-seed", dest="seed", action="store_false")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0: duration only)")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="allowed change in percent")
+    args = parser.parse_args(argv)
+
+    # Settings are read at import time, so point the app at the bench DB first.
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    # Every bench request comes from one address; measure bcrypt, not 429s.
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    from app import crud, models, startup
+    from app.core import security
+    from app.database import SessionLocal
+    from app.main import app
+
+    # httpx's ASGI transport doesn't run lifespan events, so do startup here.
+    startup.migrate()
+    if args.seed:
+        seed(
+            args.db, users=args.users, pizzas=args.pizzas, orders=args.orders,
+            items_per_order=args.items_per_order,
+            password_hash=security.get_password_hash(BENCH_PASSWORD),
+        )
+        db = SessionLocal()
+        try:
+            crud.rollup.rebuild(db)
+        finally:
+            db.close()
+
+    def bench_user(user_id: int) -> models.User:
+        role = {1: models.UserRole.ADMIN, 2: models.UserRole.DELIVERY_PARTNER}.get(user_id, models.UserRole.CUSTOMER)
+        return models.User(id=user_id, username=f"user{user_id}", role=role, token_version=0)
+
+    tokens = {
+        user_id: security.create_user_access_token(bench_user(user_id))
+        for user_id in range(1, min(args.users, 200) + 1)
+    }
+    active = load_active_orders(args.db, limit=100_000)
+    result = asyncio.run(drive(app, args, tokens, active))
+
+    print(json.dumps({k: v for k, v in result.items() if k != "routes"}, indent=2))
+    for name, route in result["routes"].items():
+        print(
+            f"{name:<16}n={route['count']:<8}err={route['errors']:<6}"
+            f"p50={route['p50_ms']:.2f}ms p95={route['p95_ms']:.2f}ms p99={route['p99_ms']:.2f}ms "
+            f"{route['throughput_rps']:.1f} rps"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
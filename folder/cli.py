@@ -0,0 +1,76 @@
+# app/cli.py
+# Imports stay inside the commands so --startup-profile sees a cold process.
+import argparse
+import time
+
+
+def migrate() -> None:
+    from app import startup
+
+    print("schema updated" if startup.migrate() else "schema already current")
+
+
+def rebuild_rollups() -> None:
+    from app import crud
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        crud.rollup.rebuild(db)
+    finally:
+        db.close()
+
+
+def startup_profile() -> None:
+    import importlib
+
+    phases = []
+
+    def timed(label, func):
+        started = time.perf_counter()
+        result = func()
+        phases.append((label, time.perf_counter() - started))
+        return result
+
+    timed("import fastapi", lambda: importlib.import_module("fastapi"))
+    timed("import sqlalchemy", lambda: importlib.import_module("sqlalchemy.orm"))
+    timed("settings", lambda: importlib.import_module("app.core.config"))
+    timed("engines", lambda: importlib.import_module("app.database"))
+    timed("models", lambda: importlib.import_module("app.models"))
+    timed("crud", lambda: importlib.import_module("app.crud"))
+    settings = importlib.import_module("app.core.config").settings
+    for name in settings.ENABLED_ROUTERS:
+        timed(f"router {name}", lambda name=name: importlib.import_module(f"app.routers.{name}"))
+    # Importing app.main builds the app (create_app) once; don't build a
+    # second one, which would also instrument the engines twice.
+    timed("import app.main + create_app", lambda: importlib.import_module("app.main"))
+    startup = importlib.import_module("app.startup")
+    timed("schema check/migrate", startup.migrate)
+    timed("pool warmup", startup.warmup)
+
+    total = sum(seconds for _, seconds in phases)
+    for label, seconds in phases:
+        print(f"{label:<32}{seconds * 1000:>10.1f} ms")
+    print(f"{'total':<32}{total * 1000:>10.1f} ms")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    parser.add_argument("--startup-profile", action="store_true", help="Time imports and startup phases")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("migrate", help="Create or update the database schema")
+    commands.add_parser("rebuild-rollups", help="Recompute the reporting rollups from orders")
+    args = parser.parse_args(argv)
+
+    if args.startup_profile:
+        startup_profile()
+    elif args.command == "migrate":
+        migrate()
+    elif args.command == "rebuild-rollups":
+        rebuild_rollups()
+    else:
+        parser.error("a command or --startup-profile is required")
+
+
+if __name__ == "__main__":
+    main()
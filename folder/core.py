@@ -1,6 +1,11 @@
 # app/core/security.py
-from datetime import datetime, timedelta
-from typing import Any, Union
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple, Union
 
 from jose import jwt
 from passlib.context import CryptContext
@@ -12,17 +17,76 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ALGORITHM = "HS256"
 
 
-def create_access_token(subject: Union[str, Any], expires_delta: timedelta | None = None) -> str:
+def create_access_token(
+    subject: Union[str, Any],
+    expires_delta: timedelta | None = None,
+    claims: Optional[Dict[str, Any]] = None,
+) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
 
-    to_encode = {"exp": expire, "sub": str(subject)}
+    # Fractional iat so a per-user revocation cleanly splits tokens issued
+    # just before it from ones issued just after, within the same second.
+    to_encode = {"exp": expire, "sub": str(subject), "iat": time.time(), "jti": uuid.uuid4().hex}
+    if claims:
+        to_encode.update(claims)
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def create_user_access_token(user: Any, expires_delta: timedelta | None = None) -> str:
+    # In claims mode the token carries everything the role dependencies need,
+    # so protected routes can skip the users lookup. uid is always present so
+    # per-user revocation can match the token.
+    claims = {"uid": user.id}
+    if settings.AUTH_CLAIMS_MODE:
+        claims.update(role=user.role.value, ver=user.token_version)
+        remember_token_version(user.id, user.token_version)
+    return create_access_token(user.username, expires_delta=expires_delta, claims=claims)
+
+
+def create_refresh_token(user: Any) -> str:
+    return create_access_token(
+        user.username,
+        expires_delta=timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+        claims={"typ": "refresh", "uid": user.id, "ver": user.token_version},
+    )
+
+
+def utc_epoch(value: datetime) -> float:
+    # Stored datetimes are naive UTC; a bare .timestamp() would read them as
+    # local time.
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def token_lifetime() -> timedelta:
+    # Upper bound on how long any issued token stays valid.
+    return max(
+        timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+        timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+
+
+# user_id -> (token_version, time it was confirmed against the DB)
+_token_versions: Dict[int, Tuple[int, float]] = {}
+
+
+def remember_token_version(user_id: int, version: int) -> None:
+    _token_versions[user_id] = (version, time.monotonic())
+
+
+def is_token_version_current(user_id: int, version: int) -> bool:
+    entry = _token_versions.get(user_id)
+    if entry is None:
+        return False
+    known_version, confirmed_at = entry
+    if time.monotonic() - confirmed_at > settings.AUTH_CLAIMS_VERSION_TTL_SECONDS:
+        return False
+    return known_version == version
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -30,21 +94,1663 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+
+class PasswordHashPoolFull(Exception):
+    pass
+
+
+class HashPoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.hash_seconds_total = 0.0
+        self.queue_wait_seconds_total = 0.0
+
+    def record(self, queue_wait: float, hash_time: float) -> None:
+        with self._lock:
+            self.completed += 1
+            self.queue_wait_seconds_total += queue_wait
+            self.hash_seconds_total += hash_time
+
+    def reject(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "in_flight": _hash_pending,
+                "hash_seconds_total": self.hash_seconds_total,
+                "queue_wait_seconds_total": self.queue_wait_seconds_total,
+            }
+
+
+hash_stats = HashPoolStats()
+
+# bcrypt releases the GIL, so a small dedicated pool keeps hashing off the
+# event loop without starving the default threadpool used by sync routes.
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+_hash_lock = threading.Lock()
+_hash_pending = 0
+
+
+async def _run_in_hash_pool(func, *args):
+    global _hash_pending
+    with _hash_lock:
+        if _hash_pending >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_LIMIT:
+            hash_stats.reject()
+            raise PasswordHashPoolFull()
+        _hash_pending += 1
+
+    submitted_at = time.perf_counter()
+
+    def timed():
+        started_at = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            hash_stats.record(started_at - submitted_at, time.perf_counter() - started_at)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, timed)
+    finally:
+        with _hash_lock:
+            _hash_pending -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_in_hash_pool(get_password_hash, password)
+
 # app/core/config.py
 from pydantic import BaseSettings
 
+# Async driver for each sync URL scheme (e.g. postgresql+psycopg2 -> asyncpg).
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "postgres": "asyncpg",
+    "mysql": "aiomysql",
+    "mariadb": "aiomysql",
+}
+
 class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    REVOCATION_SYNC_SECONDS: float = 10.0
     DATABASE_URL: str = "sqlite:///./pizza_delivery.db"
+    AUTH_CLAIMS_MODE: bool = False
+    AUTH_CLAIMS_VERSION_TTL_SECONDS: int = 60
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_LIMIT: int = 32
+    ASYNC_DATABASE_URL: str | None = None
+    QUERY_BUDGET_DEFAULT: int | None = None
+    BULK_CHUNK_SIZE: int = 500
+    EXPORT_BATCH_SIZE: int = 1000
+    CART_BACKEND: str = "db"
+    CART_TTL_SECONDS: int = 6 * 60 * 60
+    CART_MAX_CARTS: int = 50_000
+    CART_KV_PATH: str = "./cart_store.db"
+    CART_FLUSH_INTERVAL_SECONDS: int = 30
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60
+    IDEMPOTENCY_CACHE_SIZE: int = 10_000
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0
+    IDEMPOTENCY_LEASE_SECONDS: float = 30.0
+    ORDER_EVENTS_HISTORY_SIZE: int = 10_000
+    ORDER_EVENTS_BUFFER_SIZE: int = 64
+    ORDER_EVENTS_HEARTBEAT_SECONDS: float = 15.0
+    DISPATCH_DEFAULT_PROMISE_MINUTES: int = 30
+    DISPATCH_LEASE_SECONDS: int = 120
+    DISPATCH_MAX_WAIT_SECONDS: float = 25.0
+    DISPATCH_SWEEP_SECONDS: float = 5.0
+    METRICS_ENABLED: bool = True
+    DB_PROFILE: str = "default"
+    DB_POOL_SIZE: int = 5
+    DB_READ_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 64 * 1024
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    DB_AUTO_MIGRATE: bool = True
+    DB_WARMUP: bool = True
+    ENABLED_ROUTERS: list[str] = ["auth", "admin", "customer", "delivery"]
+    FAST_SERIALIZER: bool = False
+    PRICE_TABLE_TTL_SECONDS: float = 60.0
+    # e.g. [{"name": "2 for 1 margherita", "type": "bogo", "pizza_id": 1},
+    #       {"type": "combo", "pizza_ids": [1, 4], "price": 1999},
+    #       {"type": "percentage", "percent": 10, "min_subtotal": 5000}]
+    # Amounts are in minor units (cents).
+    PRICING_PROMOTIONS: list[dict] = []
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+    RATE_LIMIT_KV_PATH: str = "./rate_limits.db"
+    # Buckets idle this long are full again for every configured limit.
+    RATE_LIMIT_IDLE_SECONDS: float = 3600
+    # Peers whose X-Forwarded-For is believed when keying limits by client.
+    TRUSTED_PROXIES: list[str] = []
+    LOGIN_USERNAME_BURST: int = 5
+    LOGIN_USERNAME_PER_MINUTE: float = 5
+    LOGIN_CLIENT_BURST: int = 20
+    LOGIN_CLIENT_PER_MINUTE: float = 30
+    SIGNUP_CLIENT_BURST: int = 5
+    SIGNUP_CLIENT_PER_MINUTE: float = 5
+    MENU_CACHE_MAX_PAGES: int = 256
+    # Admin writes on another worker only reach this one's cache by expiry.
+    MENU_CACHE_TTL_SECONDS: float = 30.0
+    MENU_PAGE_MAX_LIMIT: int = 100
 
     class Config:
         env_file = ".env"
 
+    @property
+    def async_database_url(self) -> str:
+        if self.ASYNC_DATABASE_URL:
+            return self.ASYNC_DATABASE_URL
+        scheme, sep, rest = self.DATABASE_URL.partition("://")
+        dialect, _, driver = scheme.partition("+")
+        async_driver = ASYNC_DRIVERS.get(dialect)
+        if not sep or async_driver is None:
+            raise ValueError(
+                f"No async driver known for DATABASE_URL scheme {scheme!r}; set ASYNC_DATABASE_URL"
+            )
+        if driver == async_driver:
+            return self.DATABASE_URL
+        dialect = "postgresql" if dialect == "postgres" else dialect
+        return f"{dialect}+{async_driver}://{rest}"
+
 settings = Settings()
 
+# app/core/menu_cache.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from app.core.config import settings
+
+Page = Tuple[str, bytes, Optional[str]]  # etag, body, next cursor
+
+
+class MenuCache:
+    # Pre-encoded menu pages keyed by menu version plus the page key. Admin
+    # writes bump the version, which drops every cached page at once. Pages
+    # also expire after ttl_seconds, since a bump on another worker never
+    # reaches this one, and the least recently used page goes past max_pages.
+    def __init__(self, max_pages: int, ttl_seconds: float):
+        self.max_pages = max_pages
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.version = 0
+        self._pages: "OrderedDict[Tuple[int, Hashable], Tuple[float, Page]]" = OrderedDict()
+
+    def bump(self) -> int:
+        with self._lock:
+            self.version += 1
+            self._pages = OrderedDict()
+            return self.version
+
+    def get(self, key: Hashable) -> Optional[Page]:
+        page_key = (self.version, key)
+        with self._lock:
+            cached = self._pages.get(page_key)
+            if cached is None:
+                return None
+            stored_at, entry = cached
+            if time.monotonic() - stored_at >= self.ttl_seconds:
+                del self._pages[page_key]
+                return None
+            self._pages.move_to_end(page_key)
+            return entry
+
+    def put(
+        self, version: int, key: Hashable, payload, next_cursor: Optional[str] = None
+    ) -> Page:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        entry = (etag, body, next_cursor)
+        with self._lock:
+            # A bump that raced the DB read means this page is already stale.
+            if version == self.version:
+                self._pages[(version, key)] = (time.monotonic(), entry)
+                self._pages.move_to_end((version, key))
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+        return entry
+
+
+menu_cache = MenuCache(settings.MENU_CACHE_MAX_PAGES, settings.MENU_CACHE_TTL_SECONDS)
+
+# app/core/serializers.py
+import json
+from datetime import date, datetime, time
+from enum import Enum
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+from starlette.responses import Response
+
+
+def _enum_value(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+_SCALARS: Dict[type, Callable[[Any], Any]] = {
+    int: int,
+    float: float,
+    bool: bool,
+    str: str,
+    datetime: _isoformat,
+    date: _isoformat,
+    time: _isoformat,
+}
+
+
+class FastEncoder:
+    # Turns ORM rows straight into the JSON an orm_mode schema would produce
+    # via from_orm + jsonable_encoder, without building pydantic models. The
+    # per-field getters and converters are resolved once, from the schema.
+    def __init__(self, schema: Type[BaseModel]):
+        self.schema = schema
+        self._fields = tuple(
+            (field.name, attrgetter(field.name), self._converter(field))
+            for field in schema.__fields__.values()
+        )
+
+    @staticmethod
+    def _converter(field) -> Callable[[Any], Any]:
+        type_ = field.type_
+        if isinstance(type_, type) and issubclass(type_, BaseModel):
+            convert = encoder_for(type_).to_python
+        elif isinstance(type_, type) and issubclass(type_, Enum):
+            convert = _enum_value
+        elif isinstance(type_, type):
+            # By MRO, so constrained types (conint, confloat) keep the fast path.
+            convert = next((_SCALARS[base] for base in type_.__mro__ if base in _SCALARS), jsonable_encoder)
+        else:
+            convert = jsonable_encoder
+
+        if field.shape == SHAPE_LIST:
+            item_convert = convert
+            convert = lambda values: [item_convert(value) for value in values]
+        elif field.shape != SHAPE_SINGLETON:
+            convert = jsonable_encoder
+        # None reaches a non-Optional field from rows the DB hasn't filled
+        # yet (e.g. a column default before flush): emit the schema default
+        # if there is one, else null, rather than failing in the converter.
+        fallback = None if field.allow_none or field.default is None else convert(field.default)
+        not_none = convert
+        convert = lambda value: fallback if value is None else not_none(value)
+        return convert
+
+    def to_python(self, obj) -> Dict[str, Any]:
+        return {name: convert(get(obj)) for name, get, convert in self._fields}
+
+    def encode(self, obj) -> bytes:
+        return _dumps(self.to_python(obj))
+
+    def encode_many(self, objs: Iterable) -> bytes:
+        return _dumps([self.to_python(obj) for obj in objs])
+
+
+def _dumps(content) -> bytes:
+    # Same settings as starlette's JSONResponse, so bodies are byte-identical.
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+_encoders: Dict[Type[BaseModel], FastEncoder] = {}
+
+
+def encoder_for(schema: Type[BaseModel]) -> FastEncoder:
+    encoder = _encoders.get(schema)
+    if encoder is None:
+        encoder = _encoders[schema] = FastEncoder(schema)
+    return encoder
+
+
+def fast_json_response(
+    schema: Type[BaseModel], content, *, many: bool = False, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    # Response sets content-length from the pre-encoded body.
+    encoder = encoder_for(schema)
+    body = encoder.encode_many(content) if many else encoder.encode(content)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# app/core/pricing.py
+import threading
+import time
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.core.menu_cache import menu_cache
+
+
+class OrderItemError(Exception):
+    def __init__(self, pizza_id: int, detail: str):
+        super().__init__(detail)
+        self.pizza_id = pizza_id
+        self.detail = detail
+
+
+class PizzaNotFound(OrderItemError):
+    def __init__(self, pizza_id: int):
+        super().__init__(pizza_id, f"Pizza with id {pizza_id} not found")
+
+
+class PizzaUnavailable(OrderItemError):
+    def __init__(self, pizza_id: int):
+        super().__init__(pizza_id, f"Pizza with id {pizza_id} is not available")
+
+
+def to_minor(amount: float) -> int:
+    # Pizza.price is still a Float column; convert through its shortest repr
+    # so 12.99 becomes 1299, not 1298.
+    return int((Decimal(repr(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_major(amount: int) -> float:
+    return amount / 100
+
+
+class PriceEntry(NamedTuple):
+    price: int  # minor units
+    is_available: bool
+
+
+PriceTable = Dict[int, PriceEntry]
+
+
+def price_table_from_rows(rows) -> PriceTable:
+    return {row.id: PriceEntry(to_minor(row.price), bool(row.is_available)) for row in rows}
+
+
+class QuoteLine(NamedTuple):
+    pizza_id: int
+    quantity: int
+    unit_price: int
+    line_total: int
+
+
+class QuoteDiscount(NamedTuple):
+    name: str
+    amount: int
+
+
+class Quote(NamedTuple):
+    lines: List[QuoteLine]
+    subtotal: int
+    discounts: List[QuoteDiscount]
+    total: int
+
+
+# A compiled rule takes the not-yet-promoted quantities per pizza (which it
+# may consume) and the price table, and returns the discount it grants.
+Rule = Callable[[Dict[int, int], PriceTable], int]
+
+
+def _combo(pizza_ids: List[int], price: int) -> Rule:
+    def apply(remaining: Dict[int, int], prices: PriceTable) -> int:
+        sets = min(remaining.get(pizza_id, 0) for pizza_id in pizza_ids)
+        if not sets:
+            return 0
+        for pizza_id in pizza_ids:
+            remaining[pizza_id] -= sets
+        return max(0, sum(prices[pizza_id].price for pizza_id in pizza_ids) - price) * sets
+    return apply
+
+
+def _bogo(pizza_id: int) -> Rule:
+    def apply(remaining: Dict[int, int], prices: PriceTable) -> int:
+        pairs = remaining.get(pizza_id, 0) // 2
+        if not pairs:
+            return 0
+        remaining[pizza_id] -= pairs * 2
+        return prices[pizza_id].price * pairs
+    return apply
+
+
+def _percentage(percent: float, pizza_ids: Optional[List[int]], min_subtotal: int) -> Rule:
+    scope = set(pizza_ids) if pizza_ids else None
+
+    def apply(remaining: Dict[int, int], prices: PriceTable) -> int:
+        base = sum(
+            prices[pizza_id].price * quantity
+            for pizza_id, quantity in remaining.items()
+            if scope is None or pizza_id in scope
+        )
+        if not base or base < min_subtotal:
+            return 0
+        return int((Decimal(base) * Decimal(str(percent)) / 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    return apply
+
+
+def compile_rule(spec: Dict) -> Tuple[str, Rule]:
+    kind = spec.get("type")
+    if kind == "combo":
+        rule = _combo(list(spec["pizza_ids"]), int(spec["price"]))
+    elif kind == "bogo":
+        rule = _bogo(int(spec["pizza_id"]))
+    elif kind == "percentage":
+        rule = _percentage(float(spec["percent"]), spec.get("pizza_ids"), int(spec.get("min_subtotal", 0)))
+    else:
+        raise ValueError(f"Unknown promotion type: {kind!r}")
+    return spec.get("name", kind), rule
+
+
+class PricingEngine:
+    # Prices item lists from an in-memory table of pizza prices in minor
+    # units. The table is reloaded (one query for the whole menu) when the
+    # menu version moves on this worker or after PRICE_TABLE_TTL_SECONDS,
+    # which bounds staleness for admin writes made on other workers.
+    #
+    # Promotions run in configured order. Combo and BOGO consume the units
+    # they discount, so promotions never stack on the same pizza; percentage
+    # rules apply to whatever is left in their scope.
+    def __init__(self, promotions: List[Dict], ttl_seconds: float):
+        self.rules = [compile_rule(spec) for spec in promotions]
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._prices: Optional[PriceTable] = None
+        self._version = -1
+        self._loaded_at = 0.0
+
+    def prices(self, db) -> PriceTable:
+        prices = self._prices
+        if (
+            prices is not None
+            and self._version == menu_cache.version
+            and time.monotonic() - self._loaded_at < self.ttl_seconds
+        ):
+            return prices
+        from app.models.pizza import Pizza
+
+        with self._lock:
+            version = menu_cache.version
+            prices = price_table_from_rows(db.query(Pizza.id, Pizza.price, Pizza.is_available).all())
+            self._prices, self._version, self._loaded_at = prices, version, time.monotonic()
+        return prices
+
+    def quote(self, items: Iterable[Tuple[int, int]], prices: PriceTable) -> Quote:
+        quantities: Dict[int, int] = {}
+        for pizza_id, quantity in items:
+            entry = prices.get(pizza_id)
+            if entry is None:
+                raise PizzaNotFound(pizza_id)
+            if not entry.is_available:
+                raise PizzaUnavailable(pizza_id)
+            quantities[pizza_id] = quantities.get(pizza_id, 0) + quantity
+
+        lines = [
+            QuoteLine(pizza_id, quantity, prices[pizza_id].price, prices[pizza_id].price * quantity)
+            for pizza_id, quantity in quantities.items()
+        ]
+        subtotal = sum(line.line_total for line in lines)
+        remaining = dict(quantities)
+        discounts = []
+        for name, rule in self.rules:
+            amount = rule(remaining, prices)
+            if amount:
+                discounts.append(QuoteDiscount(name, amount))
+        total = max(0, subtotal - sum(discount.amount for discount in discounts))
+        return Quote(lines, subtotal, discounts, total)
+
+
+def allocate(amount: int, weights: List[int]) -> List[int]:
+    # Splits amount (minor units) across weights in proportion, handing the
+    # leftover units to the largest remainders, so the shares sum to amount.
+    total = sum(weights)
+    if not amount or not total:
+        return [0] * len(weights)
+    shares = [amount * weight // total for weight in weights]
+    by_remainder = sorted(range(len(weights)), key=lambda i: amount * weights[i] % total, reverse=True)
+    for i in by_remainder[:amount - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+pricing = PricingEngine(settings.PRICING_PROMOTIONS, settings.PRICE_TABLE_TTL_SECONDS)
+
+# app/core/query_budget.py
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    def __init__(self, parent: Optional["QueryCounter"] = None):
+        self.count = 0
+        self.seconds = 0.0
+        # Nested counters (budget middleware inside metrics middleware, say)
+        # all see every statement.
+        self.parent = parent
+
+
+# Holds a mutable counter so sync routes running in the threadpool (which get
+# a copy of the context) still add to the request's count.
+_query_counter: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+    counter = _query_counter.get()
+    while counter is not None:
+        counter.count += 1
+        counter = counter.parent
+
+
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started_at")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    counter = _query_counter.get()
+    while counter is not None:
+        counter.seconds += elapsed
+        counter = counter.parent
+    for observer in query_observers:
+        observer(elapsed)
+
+
+def _discard_query_start(context):
+    # A failed statement never reaches after_cursor_execute; drop its start
+    # time so the next statement on this connection isn't timed against it.
+    conn = context.connection
+    started = conn.info.get("query_started_at") if conn is not None else None
+    if started:
+        started.pop()
+
+
+# Callables receiving each statement's duration, e.g. the metrics histogram.
+query_observers = []
+
+
+def install_query_counter(engine) -> None:
+    if not event.contains(engine, "before_cursor_execute", _count_query):
+        event.listen(engine, "before_cursor_execute", _count_query)
+        event.listen(engine, "after_cursor_execute", _time_query)
+        event.listen(engine, "handle_error", _discard_query_start)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter(parent=_query_counter.get())
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        raise QueryBudgetExceeded(f"{counter.count} queries issued, budget is {limit}")
+
+
+class QueryBudgetMiddleware:
+    # Counts the SQL statements each request issues and compares them with a
+    # per-route budget keyed by "METHOD /path/template". The response has
+    # already been sent by then, so overruns are logged; tests catch N+1
+    # regressions with assert_max_queries around the request instead.
+    def __init__(
+        self,
+        app,
+        budgets: Optional[Dict[str, int]] = None,
+        default_budget: Optional[int] = None,
+    ):
+        self.app = app
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with count_queries() as counter:
+            await self.app(scope, receive, send)
+        route = scope.get("route")
+        key = f"{scope['method']} {route.path if route else scope['path']}"
+        budget = self.budgets.get(key, self.default_budget)
+        if budget is not None and counter.count > budget:
+            logger.warning("%s issued %d queries, budget is %d", key, counter.count, budget)
+
+# app/core/cart_store.py
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+CartItems = Dict[int, int]  # pizza_id -> quantity
+# change(items) edits the cart in place and returns whether it changed;
+# load_missing() reads a cart the store doesn't hold from the database.
+CartChange = Callable[[CartItems], bool]
+CartLoader = Callable[[], CartItems]
+
+
+class InMemoryCartStore:
+    # Per-process carts with TTL and LRU eviction. Mutations only mark the
+    # cart dirty; the periodic flush writes dirty_carts() and then calls
+    # mark_clean() with the touch times it wrote, so a failed flush or a
+    # change made during it leaves the cart dirty. Evicted dirty carts wait
+    # for that flush; once there are max_evicted of them flush_due() asks the
+    # caller to flush right away.
+    def __init__(self, ttl_seconds: int, max_carts: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_carts = max_carts
+        self.max_evicted = max(1, max_carts // 10)
+        self._lock = threading.Lock()
+        self._carts: "OrderedDict[int, tuple[CartItems, float, bool]]" = OrderedDict()
+        self._evicted_dirty: Dict[int, Tuple[CartItems, float]] = {}
+
+    def _load(self, user_id: int) -> Optional[CartItems]:
+        entry = self._carts.get(user_id)
+        if entry is None:
+            evicted = self._evicted_dirty.get(user_id)
+            return dict(evicted[0]) if evicted is not None else None
+        items, touched_at, dirty = entry
+        if time.monotonic() - touched_at > self.ttl_seconds and not dirty:
+            del self._carts[user_id]
+            return None
+        self._carts.move_to_end(user_id)
+        return dict(items)
+
+    def _save(self, user_id: int, items: CartItems, dirty: bool) -> None:
+        self._evicted_dirty.pop(user_id, None)
+        self._carts[user_id] = (dict(items), time.monotonic(), dirty)
+        self._carts.move_to_end(user_id)
+        self._evict()
+
+    def load(self, user_id: int) -> Optional[CartItems]:
+        with self._lock:
+            return self._load(user_id)
+
+    def save(self, user_id: int, items: CartItems, *, dirty: bool = True) -> None:
+        with self._lock:
+            self._save(user_id, items, dirty)
+
+    def _apply(self, user_id: int, items: CartItems, change: CartChange, missing: bool) -> CartItems:
+        changed = change(items)
+        if changed or missing:
+            self._save(user_id, items, changed)
+        return items
+
+    def modify(self, user_id: int, change: CartChange, load_missing: CartLoader) -> CartItems:
+        with self._lock:
+            items = self._load(user_id)
+            if items is not None:
+                return self._apply(user_id, items, change, False)
+        # A cold cart is read from the DB without the lock held, so one slow
+        # load doesn't stall every other cart; a cart saved meanwhile wins.
+        loaded = load_missing()
+        with self._lock:
+            items = self._load(user_id)
+            if items is not None:
+                return self._apply(user_id, items, change, False)
+            return self._apply(user_id, loaded, change, True)
+
+    def clear(self, user_id: int) -> None:
+        # Keeps an empty dirty cart as a tombstone until the next flush, so a
+        # flush that read the old items before the clear can't leave them in
+        # cart_items.
+        with self._lock:
+            self._save(user_id, {}, True)
+
+    def flush_due(self) -> bool:
+        return len(self._evicted_dirty) >= self.max_evicted
+
+    def dirty_carts(self) -> Dict[int, Tuple[CartItems, float]]:
+        with self._lock:
+            dirty = {user_id: (dict(items), touched_at) for user_id, (items, touched_at) in self._evicted_dirty.items()}
+            for user_id, (items, touched_at, is_dirty) in self._carts.items():
+                if is_dirty:
+                    dirty[user_id] = (dict(items), touched_at)
+            return dirty
+
+    def mark_clean(self, written: Dict[int, float]) -> None:
+        # Only carts untouched since they were read for the flush.
+        with self._lock:
+            for user_id, touched_at in written.items():
+                evicted = self._evicted_dirty.get(user_id)
+                if evicted is not None and evicted[1] == touched_at:
+                    del self._evicted_dirty[user_id]
+                entry = self._carts.get(user_id)
+                if entry is not None and entry[1] == touched_at:
+                    self._carts[user_id] = (entry[0], touched_at, False)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._carts:
+            user_id, (items, touched_at, dirty) = next(iter(self._carts.items()))
+            if len(self._carts) <= self.max_carts and now - touched_at <= self.ttl_seconds:
+                break
+            del self._carts[user_id]
+            # Never drop unsaved changes; the next flush still writes them.
+            if dirty:
+                self._evicted_dirty[user_id] = (items, touched_at)
+
+
+class SqliteKVCartStore:
+    # Stand-in for a shared key-value store when several workers serve the
+    # same carts: one small WAL-mode SQLite file, separate from the main DB.
+    # Read-modify-write runs in one IMMEDIATE transaction, so concurrent
+    # changes from different workers serialize instead of overwriting.
+    def __init__(self, path: str, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS carts ("
+            "user_id INTEGER PRIMARY KEY, items TEXT NOT NULL, "
+            "touched_at REAL NOT NULL, dirty INTEGER NOT NULL)"
+        )
+
+    @staticmethod
+    def _decode(items: str) -> CartItems:
+        return {int(pizza_id): quantity for pizza_id, quantity in json.loads(items).items()}
+
+    def _load(self, user_id: int) -> Optional[CartItems]:
+        row = self._conn.execute(
+            "SELECT items, touched_at, dirty FROM carts WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        items, touched_at, dirty = row
+        if time.time() - touched_at > self.ttl_seconds and not dirty:
+            self._conn.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+            return None
+        return self._decode(items)
+
+    def _save(self, user_id: int, items: CartItems, dirty: bool) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO carts (user_id, items, touched_at, dirty) VALUES (?, ?, ?, ?)",
+            (user_id, json.dumps(items), time.time(), int(dirty)),
+        )
+
+    def _transaction(self, func):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def load(self, user_id: int) -> Optional[CartItems]:
+        return self._transaction(lambda: self._load(user_id))
+
+    def save(self, user_id: int, items: CartItems, *, dirty: bool = True) -> None:
+        self._transaction(lambda: self._save(user_id, items, dirty))
+
+    def modify(self, user_id: int, change: CartChange, load_missing: CartLoader) -> CartItems:
+        def apply(loaded: Optional[CartItems]):
+            items = self._load(user_id)
+            missing = items is None
+            if missing:
+                if loaded is None:
+                    return None
+                items = loaded
+            changed = change(items)
+            if changed or missing:
+                self._save(user_id, items, changed)
+            return items
+
+        items = self._transaction(lambda: apply(None))
+        if items is None:
+            # Load a cold cart outside the IMMEDIATE transaction, which would
+            # otherwise hold the KV file's write lock through a main-DB query.
+            loaded = load_missing()
+            items = self._transaction(lambda: apply(loaded))
+        return items
+
+    def clear(self, user_id: int) -> None:
+        # Same tombstone as InMemoryCartStore.clear.
+        self._transaction(lambda: self._save(user_id, {}, True))
+
+    def flush_due(self) -> bool:
+        # Nothing is evicted; dirty rows wait in the file for the flush.
+        return False
+
+    def dirty_carts(self) -> Dict[int, Tuple[CartItems, float]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, items, touched_at FROM carts WHERE dirty = 1").fetchall()
+        return {user_id: (self._decode(items), touched_at) for user_id, items, touched_at in rows}
+
+    def mark_clean(self, written: Dict[int, float]) -> None:
+        def apply():
+            self._conn.executemany(
+                "UPDATE carts SET dirty = 0 WHERE user_id = ? AND touched_at = ?", list(written.items())
+            )
+            self._conn.execute(
+                "DELETE FROM carts WHERE dirty = 0 AND touched_at < ?", (time.time() - self.ttl_seconds,)
+            )
+
+        self._transaction(apply)
+
+
+def build_cart_store():
+    if settings.CART_BACKEND == "memory":
+        return InMemoryCartStore(settings.CART_TTL_SECONDS, settings.CART_MAX_CARTS)
+    if settings.CART_BACKEND == "sqlite_kv":
+        return SqliteKVCartStore(settings.CART_KV_PATH, settings.CART_TTL_SECONDS)
+    return None
+
+# app/core/rate_limit.py
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.core.config import settings
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Too many requests")
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class InMemoryRateLimitStore:
+    # Token buckets for this process, LRU-bounded so a spray of distinct
+    # usernames or addresses can't grow it without limit. An evicted bucket
+    # just starts full again.
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, capacity: int, rate: float) -> float:
+        # Returns 0 when a token was taken, else seconds until one is available.
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if tokens >= 1 else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SqliteRateLimitStore:
+    # Shared buckets for several workers on one host, in the same spirit as
+    # SqliteKVCartStore: each take is one IMMEDIATE transaction. Idle and
+    # excess buckets are trimmed at most once per trim_interval, not per take.
+    def __init__(self, path: str, max_keys: int, idle_seconds: float, trim_interval: float = 60.0):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.trim_interval = trim_interval
+        self._trimmed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_limits_updated_at ON rate_limits (updated_at)")
+
+    def take(self, key: str, capacity: int, rate: float) -> float:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated_at = row if row is not None else (capacity, now)
+                tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens - 1 if tokens >= 1 else tokens, now),
+                )
+                if row is None and time.monotonic() - self._trimmed_at >= self.trim_interval:
+                    self._trim(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def _trim(self, now: float) -> None:
+        # Both deletes walk ix_rate_limits_updated_at; a dropped bucket just
+        # starts full again.
+        self._trimmed_at = time.monotonic()
+        self._conn.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - self.idle_seconds,))
+        self._conn.execute(
+            "DELETE FROM rate_limits WHERE key IN "
+            "(SELECT key FROM rate_limits ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_keys,),
+        )
+
+
+class RateLimit:
+    def __init__(self, name: str, burst: int, per_minute: float):
+        self.name = name
+        self.burst = burst
+        self.rate = per_minute / 60
+
+    def key(self, value: str) -> str:
+        return f"{self.name}:{value}"
+
+
+def build_rate_limit_store():
+    if settings.RATE_LIMIT_BACKEND == "sqlite_kv":
+        return SqliteRateLimitStore(
+            settings.RATE_LIMIT_KV_PATH, settings.RATE_LIMIT_MAX_KEYS, settings.RATE_LIMIT_IDLE_SECONDS
+        )
+    return InMemoryRateLimitStore(settings.RATE_LIMIT_MAX_KEYS)
+
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store
+
+    def check(self, *limits: Tuple[RateLimit, Optional[str]]) -> None:
+        # Every bucket is charged, so an attacker rotating usernames still
+        # drains the per-address one. Raises with the longest wait.
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        wait = 0.0
+        for limit, value in limits:
+            if value:
+                wait = max(wait, self.store.take(limit.key(value), limit.burst, limit.rate))
+        if wait > 0:
+            raise RateLimited(wait)
+
+
+rate_limiter = RateLimiter(build_rate_limit_store())
+login_by_username = RateLimit("login:user", settings.LOGIN_USERNAME_BURST, settings.LOGIN_USERNAME_PER_MINUTE)
+login_by_client = RateLimit("login:client", settings.LOGIN_CLIENT_BURST, settings.LOGIN_CLIENT_PER_MINUTE)
+signup_by_client = RateLimit("signup:client", settings.SIGNUP_CLIENT_BURST, settings.SIGNUP_CLIENT_PER_MINUTE)
+
+# app/core/idempotency.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.models.idempotency import IdempotencyKey
+
+
+class IdempotencyConflict(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    status_code: int
+    body: str
+    expires_at: float
+
+
+class IdempotencyStore:
+    # Replays the stored response for a repeated Idempotency-Key. Completed
+    # keys are served from an LRU in front of the idempotency_keys table; a
+    # key still being processed makes duplicates wait for its result, via an
+    # Event in this process or by polling the pending row across workers.
+    def __init__(self, ttl_seconds: int, cache_size: int, wait_timeout: float, lease_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.wait_timeout = wait_timeout
+        # A pending row is owned only until locked_until; after that (the
+        # owner crashed or hung) the next caller takes the key over.
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+
+    def _cached(self, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            stored = self._cache.get(key)
+            if stored is None:
+                return None
+            if stored.expires_at < time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return stored
+
+    def _remember(self, key: str, request_hash: str, status_code: int, body: str) -> StoredResponse:
+        stored = StoredResponse(request_hash, status_code, body, time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._cache[key] = stored
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return stored
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    @staticmethod
+    def _check(stored: StoredResponse, request_hash: str) -> StoredResponse:
+        if stored.request_hash != request_hash:
+            raise IdempotencyConflict(422, "Idempotency-Key was already used with a different request")
+        return stored
+
+    def begin(self, db, key: str, request_hash: str) -> Optional[StoredResponse]:
+        # Returns the response to replay, or None when the caller now owns the
+        # key and must call complete() or abandon().
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            stored = self._cached(key)
+            if stored is not None:
+                return self._check(stored, request_hash)
+
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    self._inflight[key] = threading.Event()
+            if event is not None:
+                if not event.wait(max(deadline - time.monotonic(), 0)):
+                    raise IdempotencyConflict(409, "A request with this Idempotency-Key is still in progress")
+                continue
+
+            try:
+                record = db.query(IdempotencyKey).filter(IdempotencyKey.key == key).populate_existing().first()
+                if record is not None and record.expires_at < datetime.utcnow():
+                    db.delete(record)
+                    db.commit()
+                    record = None
+                if record is None:
+                    db.add(IdempotencyKey(
+                        key=key,
+                        request_hash=request_hash,
+                        locked_until=datetime.utcnow() + timedelta(seconds=self.lease_seconds),
+                        expires_at=datetime.utcnow() + timedelta(seconds=self.ttl_seconds),
+                    ))
+                    try:
+                        db.commit()
+                        return None
+                    except IntegrityError:
+                        db.rollback()
+                        record = db.query(IdempotencyKey).filter(IdempotencyKey.key == key).first()
+                if record is not None and record.status_code is not None:
+                    stored = self._remember(key, record.request_hash, record.status_code, record.response_body)
+                    self._release(key)
+                    return self._check(stored, request_hash)
+                if record is not None and self._take_over(db, record, request_hash):
+                    return None
+            except BaseException:
+                self._release(key)
+                raise
+
+            # Another worker holds the key; poll until it finishes.
+            self._release(key)
+            if time.monotonic() >= deadline:
+                raise IdempotencyConflict(409, "A request with this Idempotency-Key is still in progress")
+            time.sleep(0.05)
+
+    def _take_over(self, db, record: IdempotencyKey, request_hash: str) -> bool:
+        now = datetime.utcnow()
+        if record.locked_until is not None and record.locked_until > now:
+            return False
+        if record.request_hash != request_hash:
+            raise IdempotencyConflict(422, "Idempotency-Key was already used with a different request")
+        # Conditional, so only one of several waiting workers wins the lease.
+        taken = db.query(IdempotencyKey).filter(
+            IdempotencyKey.key == record.key,
+            IdempotencyKey.status_code.is_(None),
+            or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until <= now),
+        ).update(
+            {"locked_until": now + timedelta(seconds=self.lease_seconds)}, synchronize_session=False
+        )
+        db.commit()
+        return bool(taken)
+
+    def complete(self, db, key: str, request_hash: str, status_code: int, body: str) -> None:
+        try:
+            db.query(IdempotencyKey).filter(IdempotencyKey.key == key).update(
+                {"status_code": status_code, "response_body": body, "locked_until": None},
+                synchronize_session=False,
+            )
+            db.commit()
+            self._remember(key, request_hash, status_code, body)
+        finally:
+            self._release(key)
+
+    def abandon(self, db, key: str) -> None:
+        try:
+            db.rollback()
+            db.query(IdempotencyKey).filter(
+                IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None)
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            self._release(key)
+
+    def purge_expired(self, db) -> int:
+        removed = db.query(IdempotencyKey).filter(
+            IdempotencyKey.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        return removed
+
+
+idempotency_store = IdempotencyStore(
+    ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+    cache_size=settings.IDEMPOTENCY_CACHE_SIZE,
+    wait_timeout=settings.IDEMPOTENCY_WAIT_SECONDS,
+    lease_seconds=settings.IDEMPOTENCY_LEASE_SECONDS,
+)
+
+# app/core/revocation.py
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from app.core.security import token_lifetime, utc_epoch
+from app.models.revoked_token import RevokedToken
+
+
+class TokenRevocationList:
+    # The revoked_tokens table is the source of truth; these two dicts are the
+    # per-process front that get_current_user checks with plain lookups.
+    # sync() pulls in revocations made by other workers and drops entries
+    # that can no longer match a live token.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, float] = {}  # jti -> token expiry
+        self._users: Dict[int, float] = {}  # user_id -> revoked before (iat)
+        self._synced_through: Optional[datetime] = None
+
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        return claims.get("jti") in self._tokens or self.is_user_revoked(claims)
+
+    def is_user_revoked(self, claims: Dict[str, Any]) -> bool:
+        cutoff = self._users.get(claims.get("uid"))
+        return cutoff is not None and claims.get("iat", 0) < cutoff
+
+    def _remember(self, jti: str, user_id: Optional[int], revoked_at: datetime, expires_at: datetime) -> None:
+        with self._lock:
+            if jti.startswith("user:"):
+                self._users[user_id] = max(self._users.get(user_id, 0), utc_epoch(revoked_at))
+            else:
+                self._tokens[jti] = utc_epoch(expires_at)
+
+    def revoke(self, db, *, jti: str, expires_at: datetime, user_id: Optional[int] = None) -> None:
+        now = datetime.utcnow()
+        db.merge(RevokedToken(jti=jti, user_id=user_id, revoked_at=now, expires_at=expires_at))
+        db.commit()
+        self._remember(jti, user_id, now, expires_at)
+
+    def redeem(self, db, claims: Dict[str, Any]) -> bool:
+        # Spends a single-use token (a refresh token) by inserting its jti.
+        # The primary key makes this atomic across workers: False means the
+        # token was already spent or revoked.
+        jti = claims["jti"]
+        if jti in self._tokens:
+            return False
+        now = datetime.utcnow()
+        expires_at = datetime.utcfromtimestamp(claims["exp"])
+        db.add(RevokedToken(jti=jti, user_id=claims.get("uid"), revoked_at=now, expires_at=expires_at))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return False
+        self._remember(jti, claims.get("uid"), now, expires_at)
+        return True
+
+    def revoke_user(self, db, user_id: int) -> None:
+        # Every token issued to the user up to now, e.g. on deactivation or a
+        # password change.
+        self.revoke(db, jti=f"user:{user_id}", user_id=user_id, expires_at=datetime.utcnow() + token_lifetime())
+
+    def revoke_claims(self, db, claims: Dict[str, Any]) -> None:
+        if claims.get("jti"):
+            self.revoke(
+                db, jti=claims["jti"], user_id=claims.get("uid"),
+                expires_at=datetime.utcfromtimestamp(claims["exp"]),
+            )
+
+    def sync(self, db) -> None:
+        now = datetime.utcnow()
+        query = db.query(RevokedToken).filter(RevokedToken.expires_at > now)
+        if self._synced_through is not None:
+            # Overlap a little so rows committed out of order aren't missed.
+            query = query.filter(RevokedToken.revoked_at >= self._synced_through - timedelta(minutes=1))
+        rows = query.all()
+        expired_before = utc_epoch(now) - token_lifetime().total_seconds()
+        for row in rows:
+            self._remember(row.jti, row.user_id, row.revoked_at, row.expires_at)
+        with self._lock:
+            self._tokens = {jti: exp for jti, exp in self._tokens.items() if exp > utc_epoch(now)}
+            self._users = {uid: cutoff for uid, cutoff in self._users.items() if cutoff > expired_before}
+        self._synced_through = now
+
+    def compact(self, db) -> int:
+        deleted = db.query(RevokedToken).filter(
+            RevokedToken.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+
+revocations = TokenRevocationList()
+
+# app/core/order_events.py
+import asyncio
+import itertools
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from app.core.config import settings
+
+
+class OrderEventSubscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, user_id: Optional[int], order_id: Optional[int], buffer_size: int):
+        self.loop = loop
+        self.user_id = user_id
+        self.order_id = order_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        # Set when the subscriber fell behind; the stream closes and the client
+        # reconnects with Last-Event-ID to replay what it missed.
+        self.overflowed = False
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        if self.user_id is not None and event["user_id"] != self.user_id:
+            return False
+        if self.order_id is not None and event["order_id"] != self.order_id:
+            return False
+        return True
+
+    def _offer(self, event: Dict[str, Any]) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The queue is full, so the reader is not blocked and will see the
+            # flag once it has drained what was delivered before the gap.
+            self.overflowed = True
+
+
+class OrderEventBroker:
+    # In-process pub/sub for order status changes. publish() is safe to call
+    # from sync routes running in the threadpool.
+    def __init__(self, history_size: int, buffer_size: int):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history_size)
+        self._subscribers: Set[OrderEventSubscriber] = set()
+
+    def publish(self, *, order_id: int, user_id: int, status: str, updated_at: Any = None) -> Dict[str, Any]:
+        with self._lock:
+            event = {
+                "id": next(self._ids),
+                "order_id": order_id,
+                "user_id": user_id,
+                "status": status,
+                "updated_at": updated_at,
+            }
+            self._history.append(event)
+            subscribers = [s for s in self._subscribers if s.wants(event)]
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber._offer, event)
+        return event
+
+    def subscribe(
+        self, *, user_id: Optional[int] = None, order_id: Optional[int] = None,
+        last_event_id: Optional[int] = None
+    ) -> tuple[OrderEventSubscriber, List[Dict[str, Any]]]:
+        subscriber = OrderEventSubscriber(asyncio.get_running_loop(), user_id, order_id, self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            missed = []
+            if last_event_id is not None:
+                missed = [e for e in self._history if e["id"] > last_event_id and subscriber.wants(e)]
+        return subscriber, missed
+
+    def unsubscribe(self, subscriber: OrderEventSubscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+
+order_events = OrderEventBroker(
+    history_size=settings.ORDER_EVENTS_HISTORY_SIZE,
+    buffer_size=settings.ORDER_EVENTS_BUFFER_SIZE,
+)
+
+# app/core/dispatch.py
+import asyncio
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.security import utc_epoch
+
+
+class DispatchQueue:
+    # Orders ready for pickup, most urgent first (promised time, then age).
+    # Removal is lazy: entries are dropped when they surface, so every
+    # operation stays O(log n). This is only an index; the conditional UPDATE
+    # in CRUDOrder.claim_for_delivery decides who actually gets an order.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready: List[Tuple[float, float, int]] = []
+        self._queued: Set[int] = set()
+        self._leases: List[Tuple[float, int]] = []
+        self._lease_expiry: Dict[int, float] = {}
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    @staticmethod
+    def priority(created_at: datetime, promised_at: Optional[datetime]) -> Tuple[float, float]:
+        promised_at = promised_at or created_at + timedelta(minutes=settings.DISPATCH_DEFAULT_PROMISE_MINUTES)
+        return utc_epoch(promised_at), utc_epoch(created_at)
+
+    def push(self, order_id: int, created_at: datetime, promised_at: Optional[datetime] = None) -> None:
+        with self._lock:
+            if order_id in self._queued or order_id in self._lease_expiry:
+                return
+            heapq.heappush(self._ready, (*self.priority(created_at, promised_at), order_id))
+            self._queued.add(order_id)
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def pop(self) -> Optional[int]:
+        with self._lock:
+            while self._ready:
+                *_, order_id = heapq.heappop(self._ready)
+                if order_id in self._queued:
+                    self._queued.discard(order_id)
+                    return order_id
+            return None
+
+    def discard(self, order_id: int) -> None:
+        with self._lock:
+            self._queued.discard(order_id)
+            self._lease_expiry.pop(order_id, None)
+
+    def lease(self, order_id: int, expires_at: datetime) -> None:
+        expires = utc_epoch(expires_at)
+        with self._lock:
+            self._lease_expiry[order_id] = expires
+            heapq.heappush(self._leases, (expires, order_id))
+
+    def expire_leases(self, now: Optional[float] = None) -> List[int]:
+        # Returns abandoned orders; the caller re-reads them and pushes them back.
+        now = time.time() if now is None else now
+        expired = []
+        with self._lock:
+            while self._leases and self._leases[0][0] <= now:
+                expires, order_id = heapq.heappop(self._leases)
+                if self._lease_expiry.get(order_id) == expires:
+                    del self._lease_expiry[order_id]
+                    expired.append(order_id)
+        return expired
+
+    async def wait(self, timeout: float) -> None:
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self._ready:
+                return
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+
+dispatch_queue = DispatchQueue()
+
+# app/core/order_hooks.py
+from app.core.dispatch import dispatch_queue
+from app.core.order_events import order_events
+from app.models.order import OrderStatus
+
+
+def order_status_changed(order) -> None:
+    # Runs after a committed status change, from any handler that makes one.
+    order_events.publish(
+        order_id=order.id, user_id=order.user_id,
+        status=order.status.value, updated_at=order.updated_at.isoformat()
+    )
+    if order.status == OrderStatus.READY_FOR_PICKUP:
+        dispatch_queue.push(order.id, order.created_at, order.promised_at)
+    else:
+        dispatch_queue.discard(order.id)
+
+# app/core/metrics.py
+import bisect
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from app.core.query_budget import count_queries, install_query_counter, query_observers
+from app.core.security import hash_stats
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    # Fixed buckets; observe() is a bisect plus a few increments under a
+    # short lock, cheap enough to leave on in production.
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for label_values, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, delta: float) -> None:
+        with self._lock:
+            self.value += delta
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", labels=("method", "route", "status")
+)
+requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+request_db_queries = Histogram(
+    "http_request_db_queries", "SQL statements issued per request.", labels=("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+request_db_seconds = Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request.", labels=("method", "route")
+)
+db_query_duration = Histogram("db_query_duration_seconds", "Duration of individual SQL statements.")
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Time waiting to check a connection out of the pool."
+)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in (
+        request_duration, requests_in_flight, request_db_queries, request_db_seconds,
+        db_query_duration, db_pool_checkout_wait,
+    ):
+        lines.extend(metric.render())
+    hashing = hash_stats.snapshot()
+    for name, key, kind, help in (
+        ("password_hash_completed_total", "completed", "counter", "Password hash operations completed."),
+        ("password_hash_rejected_total", "rejected", "counter", "Password hash operations rejected because the pool was full."),
+        ("password_hash_seconds_total", "hash_seconds_total", "counter", "Time spent hashing passwords."),
+        ("password_hash_queue_wait_seconds_total", "queue_wait_seconds_total", "counter", "Time password hash jobs waited for a worker."),
+        ("password_hash_in_flight", "in_flight", "gauge", "Password hash jobs queued or running."),
+    ):
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {hashing[key]}"]
+    return "\n".join(lines) + "\n"
+
+
+def instrument_engine(engine) -> None:
+    install_query_counter(engine)
+    if db_query_duration.observe not in query_observers:
+        query_observers.append(db_query_duration.observe)
+
+    # The pool has no "waiting for checkout" event, so time its connect().
+    # Marked so instrumenting the same engine twice doesn't time it twice.
+    pool = engine.pool
+    if getattr(pool, "_checkout_timed", False):
+        return
+    connect = pool.connect
+
+    def timed_connect(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return connect(*args, **kwargs)
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+    pool._checkout_timed = True
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = ["500"]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        requests_in_flight.add(1)
+        started = time.perf_counter()
+        try:
+            with count_queries() as counter:
+                await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.add(-1)
+            route = scope.get("route")
+            # Route templates, not raw paths, keep label cardinality bounded.
+            route_label = route.path if route else "unmatched"
+            request_duration.observe(elapsed, scope["method"], route_label, status[0])
+            request_db_queries.observe(counter.count, scope["method"], route_label)
+            request_db_seconds.observe(counter.seconds, scope["method"], route_label)
+
 ## depepndencies
 python-jose[cryptography]
 passlib[bcrypt]
+sqlalchemy[asyncio]
+aiosqlite
+httpx  # app.bench only
 
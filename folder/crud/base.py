@@ -1,7 +1,17 @@
 # app/crud/base.py
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+import base64
+import json
+import operator
+from datetime import datetime
+from enum import Enum
+from itertools import islice
+from typing import (
+    Any, Callable, Dict, Generic, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple,
+    Type, TypeVar, Union
+)
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 from app.database import Base
 
@@ -9,15 +19,139 @@ ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(jsonable_encoder(list(values)), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+class InvalidQuerySpec(ValueError):
+    pass
+
+class Filter(NamedTuple):
+    field: str
+    op: str  # one of FILTER_OPS
+    value: Any
+
+class Sort(NamedTuple):
+    field: str
+    descending: bool = False
+
+    @classmethod
+    def parse(cls, spec: str) -> "Sort":
+        # "created_at" or "-created_at"
+        return cls(spec.lstrip("-"), spec.startswith("-"))
+
+FILTER_OPS: Dict[str, Callable[[Any, Any], Any]] = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "in": lambda column, values: column.in_(values),
+}
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
-    def __init__(self, model: Type[ModelType]):
+    def __init__(
+        self, model: Type[ModelType], *, load_options: Sequence[Any] = (),
+        filter_fields: Mapping[str, Iterable[str]] = (), sort_fields: Iterable[str] = ("id",)
+    ):
         self.model = model
+        # Loader options (selectinload/joinedload) applied to every read unless
+        # the caller passes its own, so relationships serialize without N+1.
+        self.load_options = tuple(load_options)
+        # Whitelists for get_multi: field -> allowed ops, and sortable fields.
+        # Keep them to columns an index can serve.
+        self.filter_fields = {field: frozenset(ops) for field, ops in dict(filter_fields).items()}
+        self.sort_fields = frozenset(sort_fields)
+
+    def query(self, db: Session, options: Optional[Sequence[Any]] = None):
+        query = db.query(self.model)
+        options = self.load_options if options is None else options
+        if options:
+            query = query.options(*options)
+        return query
+
+    def get(self, db: Session, id: Any, *, options: Optional[Sequence[Any]] = None) -> Optional[ModelType]:
+        return self.query(db, options).filter(self.model.id == id).first()
 
-    def get(self, db: Session, id: Any) -> Optional[ModelType]:
-        return db.query(self.model).filter(self.model.id == id).first()
+    def apply_spec(self, query, filters: Sequence[Filter] = (), sort: Sequence[Sort] = ()):
+        for spec in filters:
+            if spec.op not in self.filter_fields.get(spec.field, ()):
+                raise InvalidQuerySpec(f"Cannot filter on {spec.field} with {spec.op}")
+            query = query.filter(FILTER_OPS[spec.op](getattr(self.model, spec.field), spec.value))
+        order_by = []
+        for spec in sort:
+            if spec.field not in self.sort_fields:
+                raise InvalidQuerySpec(f"Cannot sort on {spec.field}")
+            column = getattr(self.model, spec.field)
+            order_by.append(column.desc() if spec.descending else column)
+        # id breaks ties so offset pages are stable.
+        if not any(spec.field == "id" for spec in sort):
+            order_by.append(self.model.id.desc() if sort and sort[-1].descending else self.model.id)
+        return query.order_by(*order_by)
 
-    def get_multi(self, db: Session, *, skip: int = 0, limit: int = 100) -> List[ModelType]:
-        return db.query(self.model).offset(skip).limit(limit).all()
+    def get_multi(
+        self, db: Session, *, skip: int = 0, limit: int = 100, options: Optional[Sequence[Any]] = None,
+        filters: Sequence[Filter] = (), sort: Sequence[Sort] = ()
+    ) -> List[ModelType]:
+        query = self.apply_spec(self.query(db, options), filters, sort)
+        return query.offset(skip).limit(limit).all()
+
+    def get_multi_keyset(
+        self, db: Session, *, sort: Sort = Sort("id"), cursor: Optional[str] = None, limit: int = 100,
+        filters: Sequence[Filter] = (), options: Optional[Sequence[Any]] = None
+    ) -> Tuple[List[ModelType], Optional[str]]:
+        # Filtered get_multi paged by (sort field, id) instead of OFFSET, so a
+        # deep page is an index seek rather than a scan past every skipped row.
+        query = self.apply_spec(self.query(db, options), filters, [sort])
+        column = getattr(self.model, sort.field)
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != 2:
+                raise InvalidQuerySpec("Invalid cursor")
+            value, last_id = values
+            python_type = column.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(str(value))
+            elif issubclass(python_type, Enum):
+                # Cursors carry the enum's value; the column binds members.
+                value = python_type(value)
+            keys, bound = tuple_(column, self.model.id), (value, last_id)
+            if sort.field == "id":
+                keys, bound = self.model.id, last_id
+            query = query.filter(keys < bound if sort.descending else keys > bound)
+        items = query.limit(limit).all()
+        next_cursor = None
+        if items and len(items) == limit:
+            next_cursor = encode_cursor([getattr(items[-1], sort.field), items[-1].id])
+        return items, next_cursor
+
+    def get_multi_after(
+        self, db: Session, *, cursor: Optional[str] = None, limit: int = 100,
+        options: Optional[Sequence[Any]] = None
+    ) -> Tuple[List[ModelType], Optional[str]]:
+        query = self.query(db, options).order_by(self.model.id)
+        if cursor:
+            (last_id,) = decode_cursor(cursor)
+            query = query.filter(self.model.id > last_id)
+        items = query.limit(limit).all()
+        next_cursor = encode_cursor([items[-1].id]) if items and len(items) == limit else None
+        return items, next_cursor
 
     def create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType:
         obj_in_data = jsonable_encoder(obj_in)
@@ -45,4 +179,98 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         obj = db.query(self.model).get(id)
         db.delete(obj)
         db.commit()
-        return obj
\ No newline at end of file
+        return obj
+
+    # Bulk variants skip per-row refreshes and commit once per chunk, so a
+    # 500-row load is a single executemany and a single transaction.
+    def create_many(self, db: Session, *, objs_in: Iterable[CreateSchemaType], chunk_size: int = 500) -> int:
+        created = 0
+        for chunk in chunked(objs_in, chunk_size):
+            db.bulk_insert_mappings(self.model, [jsonable_encoder(obj_in) for obj_in in chunk])
+            db.commit()
+            created += len(chunk)
+        return created
+
+    def update_many(
+        self, db: Session, *, objs_in: Iterable[Tuple[Any, Union[UpdateSchemaType, Dict[str, Any]]]],
+        chunk_size: int = 500
+    ) -> Set[Any]:
+        updated = set()
+        for chunk in chunked(objs_in, chunk_size):
+            ids = {id for id, _ in chunk}
+            existing = {row.id for row in db.query(self.model.id).filter(self.model.id.in_(ids))}
+            mappings = []
+            for id, obj_in in chunk:
+                if id not in existing:
+                    continue
+                update_data = obj_in if isinstance(obj_in, dict) else obj_in.dict(exclude_unset=True)
+                mappings.append({**update_data, "id": id})
+            if mappings:
+                db.bulk_update_mappings(self.model, mappings)
+                db.commit()
+            updated |= existing
+        return updated
+
+    def remove_many(self, db: Session, *, ids: Iterable[Any], chunk_size: int = 500) -> int:
+        removed = 0
+        for chunk in chunked(ids, chunk_size):
+            removed += db.query(self.model).filter(self.model.id.in_(chunk)).delete(synchronize_session=False)
+            db.commit()
+        return removed
+
+# app/crud/async_base.py
+from typing import Any, Dict, Generic, List, Optional, Sequence, Type, Union
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.crud.base import CreateSchemaType, ModelType, UpdateSchemaType
+
+class AsyncCRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
+    def __init__(self, model: Type[ModelType], *, load_options: Sequence[Any] = ()):
+        self.model = model
+        self.load_options = tuple(load_options)
+
+    def select(self, options: Optional[Sequence[Any]] = None):
+        stmt = select(self.model)
+        options = self.load_options if options is None else options
+        if options:
+            stmt = stmt.options(*options)
+        return stmt
+
+    async def get(self, db: AsyncSession, id: Any, *, options: Optional[Sequence[Any]] = None) -> Optional[ModelType]:
+        options = self.load_options if options is None else options
+        return await db.get(self.model, id, options=options)
+
+    async def get_multi(
+        self, db: AsyncSession, *, skip: int = 0, limit: int = 100, options: Optional[Sequence[Any]] = None
+    ) -> List[ModelType]:
+        result = await db.execute(self.select(options).order_by(self.model.id).offset(skip).limit(limit))
+        return result.unique().scalars().all()
+
+    async def create(self, db: AsyncSession, *, obj_in: CreateSchemaType) -> ModelType:
+        obj_in_data = jsonable_encoder(obj_in)
+        db_obj = self.model(**obj_in_data)
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def update(self, db: AsyncSession, *, db_obj: ModelType, obj_in: Union[UpdateSchemaType, Dict[str, Any]]) -> ModelType:
+        obj_data = jsonable_encoder(db_obj)
+        if isinstance(obj_in, dict):
+            update_data = obj_in
+        else:
+            update_data = obj_in.dict(exclude_unset=True)
+        for field in obj_data:
+            if field in update_data:
+                setattr(db_obj, field, update_data[field])
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def remove(self, db: AsyncSession, *, id: int) -> ModelType:
+        obj = await db.get(self.model, id)
+        await db.delete(obj)
+        await db.commit()
+        return obj
@@ -1,6 +1,7 @@
 # app/crud/user.py
-from typing import Optional
+from typing import Any, Dict, Optional, Union
 from sqlalchemy.orm import Session
+from app.core.revocation import revocations
 from app.core.security import get_password_hash, verify_password
 from app.crud.base import CRUDBase
 from app.models.user import User
@@ -25,6 +26,33 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         db.refresh(db_obj)
         return db_obj
 
+    def update(self, db: Session, *, db_obj: User, obj_in: Union[UserUpdate, Dict[str, Any]]) -> User:
+        if isinstance(obj_in, dict):
+            update_data = dict(obj_in)
+        else:
+            update_data = obj_in.dict(exclude_unset=True)
+        if update_data.get("password"):
+            update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
+        # Any change that affects authorization invalidates outstanding claims tokens.
+        # The revocation entry also logs out plain bearer and refresh tokens at once.
+        if update_data.keys() & {"hashed_password", "role", "is_active", "username"}:
+            update_data["token_version"] = (db_obj.token_version or 0) + 1
+            return self._update_and_revoke(db, db_obj=db_obj, update_data=update_data)
+        return super().update(db, db_obj=db_obj, obj_in=update_data)
+
+    def bump_token_version(self, db: Session, *, db_obj: User) -> User:
+        return self._update_and_revoke(
+            db, db_obj=db_obj, update_data={"token_version": (db_obj.token_version or 0) + 1}
+        )
+
+    def _update_and_revoke(self, db: Session, *, db_obj: User, update_data: Dict[str, Any]) -> User:
+        # The update goes first: revoke() commits, which expires db_obj, and
+        # the base update would then find no loaded fields to copy onto.
+        db_obj = super().update(db, db_obj=db_obj, obj_in=update_data)
+        revocations.revoke_user(db, db_obj.id)
+        db.refresh(db_obj)
+        return db_obj
+
     def authenticate(self, db: Session, *, username: str, password: str) -> Optional[User]:
         user = self.get_by_username(db, username=username)
         if not user:
@@ -46,41 +74,457 @@ class CRUDPizza(CRUDBase[Pizza, PizzaCreate, PizzaUpdate]):
 pizza = CRUDPizza(Pizza)
 
 # app/crud/order.py
-from typing import List
-from sqlalchemy.orm import Session
-from app.crud.base import CRUDBase
-from app.models.order import Order, OrderItem
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from datetime import timedelta
+from sqlalchemy import Row, insert, or_, select, tuple_, update
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from app.core.pricing import (
+    OrderItemError, PizzaNotFound, PizzaUnavailable, allocate, price_table_from_rows, pricing, to_major
+)
+from app.crud.base import CRUDBase, Filter, decode_cursor, encode_cursor
+from app.crud.rollup import rollup
+from app.models.order import Order, OrderItem, OrderStatus
+from app.models.pizza import Pizza
 from app.schemas.order import OrderCreate, OrderUpdate
 
+class OrderNotFound(Exception):
+    detail = "Order not found"
+
+class OrderNotAssigned(Exception):
+    detail = "Order is not assigned to you"
+
+class OrderStatusConflict(Exception):
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+# Legal status moves. Anything else, including moving backwards out of a
+# terminal status, is rejected.
+ORDER_TRANSITIONS: Dict[OrderStatus, Tuple[OrderStatus, ...]] = {
+    OrderStatus.PLACED: (OrderStatus.PREPARING, OrderStatus.CANCELLED),
+    OrderStatus.PREPARING: (OrderStatus.READY_FOR_PICKUP, OrderStatus.CANCELLED),
+    OrderStatus.READY_FOR_PICKUP: (OrderStatus.OUT_FOR_DELIVERY, OrderStatus.CANCELLED),
+    OrderStatus.OUT_FOR_DELIVERY: (OrderStatus.DELIVERED,),
+    OrderStatus.DELIVERED: (),
+    OrderStatus.CANCELLED: (),
+}
+
+def status_sources(status: OrderStatus) -> List[OrderStatus]:
+    return [source for source, targets in ORDER_TRANSITIONS.items() if status in targets]
+
+def order_pizza_query(obj_in: OrderCreate):
+    pizza_ids = {item.pizza_id for item in obj_in.items}
+    return select(Pizza.id, Pizza.price, Pizza.is_available).where(Pizza.id.in_(pizza_ids))
+
+def build_order(obj_in: OrderCreate, *, user_id: int, pizza_rows) -> Tuple[Order, List[Dict[str, Any]]]:
+    # Priced by the same engine as /customer/quote, but from the rows just
+    # read rather than the cached table, so the order uses current prices.
+    # Returns the order and its lines as rows for insert_order_items.
+    prices = price_table_from_rows(pizza_rows)
+    quote = pricing.quote(((item.pizza_id, item.quantity) for item in obj_in.items), prices)
+    # The discount is spread over the lines so per-pizza revenue (and the
+    # rollups rebuilt from order_items) adds up to total_amount.
+    discount = quote.subtotal - quote.total
+    shares = allocate(discount, [prices[item.pizza_id].price * item.quantity for item in obj_in.items])
+    lines = [
+        {
+            "pizza_id": item.pizza_id, "quantity": item.quantity,
+            "unit_price": to_major(prices[item.pizza_id].price), "discount_amount": to_major(share),
+        }
+        for item, share in zip(obj_in.items, shares)
+    ]
+    return Order(user_id=user_id, total_amount=to_major(quote.total), discount_amount=to_major(discount)), lines
+
+def insert_order_items(order_id: int, lines: List[Dict[str, Any]]):
+    # A Core executemany without RETURNING: SQLite has no insertmanyvalues
+    # sentinel, so ORM-flushed lines would each be an INSERT ... RETURNING.
+    return insert(OrderItem.__table__), [dict(line, order_id=order_id) for line in lines]
+
+def order_items_query(order_id: int):
+    return select(OrderItem).where(OrderItem.order_id == order_id).order_by(OrderItem.id)
+
+def detach_order(db, order: Order) -> None:
+    # Detached objects keep the state loaded by the flush instead of being
+    # expired by the commit, so serializing them needs no refresh round trip.
+    for order_item in order.order_items:
+        db.expunge(order_item)
+    db.expunge(order)
+
 class CRUDOrder(CRUDBase[Order, OrderCreate, OrderUpdate]):
     def create_with_items(self, db: Session, *, obj_in: OrderCreate, user_id: int) -> Order:
-        db_obj = Order(user_id=user_id, total_amount=0)
-        for item in obj_in.items:
-            order_item = OrderItem(**item.dict(), order=db_obj)
-            db.add(order_item)
-            db_obj.total_amount += order_item.unit_price * order_item.quantity
+        pizza_rows = db.execute(order_pizza_query(obj_in)).all()
+        db_obj, lines = build_order(obj_in, user_id=user_id, pizza_rows=pizza_rows)
         db.add(db_obj)
+        # One INSERT for the order (for its id), one executemany for all of
+        # its lines and one SELECT reading them back, whatever the line count.
+        db.flush()
+        db.connection().execute(*insert_order_items(db_obj.id, lines))
+        set_committed_value(db_obj, "order_items", db.scalars(order_items_query(db_obj.id)).all())
+        rollup.record_order(db, order=db_obj)
+        detach_order(db, db_obj)
+        db.commit()
+        return db_obj
+
+    def transition(
+        self, db: Session, *, order_id: int, status: OrderStatus, expected_version: Optional[int] = None,
+        partner_id: Optional[int] = None
+    ) -> Order:
+        # One conditional UPDATE ... RETURNING per candidate source status. It
+        # only matches while the order is still in that status (and at the
+        # caller's version, when given), so a concurrent admin and delivery
+        # write can't both apply. Only cancellation has several sources; every
+        # forward move has exactly one, so it is a single statement.
+        for old_status in status_sources(status):
+            stmt = (
+                update(Order)
+                .where(Order.id == order_id, Order.status == old_status)
+                .values(status=status, version=Order.version + 1, updated_at=datetime.utcnow())
+                .returning(Order)
+                .execution_options(synchronize_session=False, populate_existing=True)
+            )
+            if expected_version is not None:
+                stmt = stmt.where(Order.version == expected_version)
+            if partner_id is not None:
+                # Delivery partners may only move orders leased to them.
+                stmt = stmt.where(Order.assigned_partner_id == partner_id)
+            db_obj = db.execute(stmt).scalar_one_or_none()
+            if db_obj is not None:
+                break
+        else:
+            db.rollback()
+            self._raise_transition_error(db, order_id, status, expected_version, partner_id)
+        rollup.record_status_change(
+            db, created_at=db_obj.created_at, old_status=old_status, new_status=status
+        )
+        # Detaching loads the items the response needs before the commit.
+        detach_order(db, db_obj)
         db.commit()
-        db.refresh(db_obj)
         return db_obj
 
+    def _raise_transition_error(
+        self, db: Session, order_id: int, status: OrderStatus, expected_version: Optional[int],
+        partner_id: Optional[int]
+    ) -> None:
+        # Failure path only: one read to say why nothing matched.
+        row = db.execute(
+            select(Order.status, Order.version, Order.assigned_partner_id).where(Order.id == order_id)
+        ).first()
+        if row is None:
+            raise OrderNotFound()
+        if partner_id is not None and row.assigned_partner_id != partner_id:
+            raise OrderNotAssigned()
+        if status not in ORDER_TRANSITIONS[row.status]:
+            raise OrderStatusConflict(f"Cannot change order status from {row.status.value} to {status.value}")
+        raise OrderStatusConflict(
+            f"Order was modified concurrently (expected version {expected_version}, found {row.version})"
+        )
+
+    def transition_many(
+        self, db: Session, *, status: OrderStatus, order_ids: Optional[Sequence[int]] = None,
+        filters: Sequence[Filter] = (), limit: int = 500
+    ) -> Tuple[List[Row], Dict[int, Optional[OrderStatus]]]:
+        # Set-based transition: one UPDATE ... WHERE id IN (...) AND status = ?
+        # RETURNING per legal source status (just one for forward moves), the
+        # rollup deltas as one upsert, and a single commit. Returns the changed
+        # rows, plus the current status (None if missing) of every requested
+        # order that didn't change.
+        if order_ids is None:
+            # Only orders the move is legal for, so terminal orders can't
+            # fill the batch and starve eligible ones.
+            eligible = select(Order.id).where(Order.status.in_(status_sources(status)))
+            order_ids = db.execute(self.apply_spec(eligible, filters).limit(limit)).scalars().all()
+        if not order_ids:
+            return [], {}
+        now = datetime.utcnow()
+        changed: List[Row] = []
+        changes = []
+        for old_status in status_sources(status):
+            rows = db.execute(
+                update(Order)
+                .where(Order.id.in_(order_ids), Order.status == old_status)
+                .values(status=status, version=Order.version + 1, updated_at=now)
+                .returning(
+                    Order.id, Order.user_id, Order.status, Order.created_at, Order.updated_at, Order.promised_at
+                )
+                .execution_options(synchronize_session=False)
+            ).all()
+            changed.extend(rows)
+            changes.extend((row.created_at, old_status, status) for row in rows)
+        rollup.record_status_changes(db, changes=changes)
+        db.commit()
+
+        unchanged = set(order_ids) - {row.id for row in changed}
+        current: Dict[int, OrderStatus] = {}
+        if unchanged:
+            current = dict(db.execute(select(Order.id, Order.status).where(Order.id.in_(unchanged))).all())
+        return changed, {order_id: current.get(order_id) for order_id in unchanged}
+
     def get_user_orders(self, db: Session, *, user_id: int, skip: int = 0, limit: int = 100) -> List[Order]:
-        return db.query(Order).filter(Order.user_id == user_id).offset(skip).limit(limit).all()
+        return (
+            self.query(db)
+            .filter(Order.user_id == user_id)
+            .order_by(Order.created_at, Order.id)
+            .offset(skip)
+            .limit(limit)
+            .all()
+        )
 
-order = CRUDOrder(Order)
+    def get_user_orders_after(
+        self, db: Session, *, user_id: int, cursor: Optional[str] = None, limit: int = 100
+    ) -> Tuple[List[Order], Optional[str]]:
+        # Walks ix_orders_user_created_id, so every page is an index seek.
+        query = self.query(db).filter(Order.user_id == user_id).order_by(Order.created_at, Order.id)
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            query = query.filter(
+                tuple_(Order.created_at, Order.id) > (datetime.fromisoformat(str(created_at)), last_id)
+            )
+        items = query.limit(limit).all()
+        next_cursor = None
+        if items and len(items) == limit:
+            next_cursor = encode_cursor([items[-1].created_at, items[-1].id])
+        return items, next_cursor
 
-# app/crud/cart.py
-from typing import List
+    def claim_for_delivery(
+        self, db: Session, *, order_id: int, partner_id: int, lease_seconds: int
+    ) -> Optional[Order]:
+        # Single conditional UPDATE: it only matches while the order is still
+        # ready and unleased (or its lease lapsed), so two partners can never
+        # both win it, even across workers.
+        now = datetime.utcnow()
+        claimed = db.query(Order).filter(
+            Order.id == order_id,
+            Order.status == OrderStatus.READY_FOR_PICKUP,
+            or_(Order.lease_expires_at.is_(None), Order.lease_expires_at < now),
+        ).update(
+            {"assigned_partner_id": partner_id, "lease_expires_at": now + timedelta(seconds=lease_seconds)},
+            synchronize_session=False,
+        )
+        db.commit()
+        if not claimed:
+            return None
+        return self.get(db, order_id)
+
+    def get_dispatchable(self, db: Session, *, limit: int = 10_000):
+        now = datetime.utcnow()
+        return db.query(Order.id, Order.created_at, Order.promised_at).filter(
+            Order.status == OrderStatus.READY_FOR_PICKUP,
+            or_(Order.lease_expires_at.is_(None), Order.lease_expires_at < now),
+        ).limit(limit).all()
+
+    def iter_export_rows(
+        self, db: Session, *, created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None, batch_size: int = 1000
+    ) -> Iterator[Dict[str, Any]]:
+        # One flat row per order item, streamed with a server-side cursor so
+        # memory stays at one batch no matter how many orders match.
+        stmt = (
+            select(
+                Order.id.label("order_id"),
+                Order.user_id,
+                Order.status,
+                Order.total_amount,
+                Order.created_at,
+                Order.updated_at,
+                OrderItem.id.label("order_item_id"),
+                OrderItem.pizza_id,
+                OrderItem.quantity,
+                OrderItem.unit_price,
+                OrderItem.discount_amount,
+            )
+            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .order_by(Order.created_at, Order.id, OrderItem.id)
+        )
+        if created_from is not None:
+            stmt = stmt.where(Order.created_at >= created_from)
+        if created_to is not None:
+            stmt = stmt.where(Order.created_at < created_to)
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+        for partition in result.mappings().partitions():
+            yield from partition
+
+order = CRUDOrder(
+    Order,
+    load_options=[selectinload(Order.order_items)],
+    filter_fields={
+        "status": {"eq", "in"},
+        "user_id": {"eq"},
+        "created_at": {"ge", "gt", "le", "lt"},
+        "total_amount": {"ge", "gt", "le", "lt"},
+    },
+    # status sorts walk ix_orders_status_created_id.
+    sort_fields={"id", "status", "created_at", "total_amount"},
+)
+
+# app/crud/rollup.py
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
+from app.models.order import Order, OrderItem, OrderStatus
+from app.models.rollup import OrdersDailyStatus, SalesDailyPizza
+
+class CRUDRollup:
+    # Pre-aggregated reporting tables. The record_* methods only add pending
+    # statements to the caller's transaction, so rollups commit or roll back
+    # together with the order change that produced them.
+    def _bump_status(self, db: Session, day: date, status: OrderStatus, delta: int) -> None:
+        stmt = sqlite_insert(OrdersDailyStatus).values(day=day, status=status, count=delta)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[OrdersDailyStatus.day, OrdersDailyStatus.status],
+            set_={"count": OrdersDailyStatus.count + stmt.excluded.count},
+        ))
+
+    def record_order(self, db: Session, *, order: Order) -> None:
+        day = order.created_at.date()
+        totals = defaultdict(lambda: [0, 0.0])
+        for item in order.order_items:
+            totals[item.pizza_id][0] += item.quantity
+            totals[item.pizza_id][1] += item.quantity * item.unit_price - (item.discount_amount or 0)
+        if totals:
+            stmt = sqlite_insert(SalesDailyPizza).values([
+                {"day": day, "pizza_id": pizza_id, "quantity": quantity, "revenue": revenue}
+                for pizza_id, (quantity, revenue) in totals.items()
+            ])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[SalesDailyPizza.day, SalesDailyPizza.pizza_id],
+                set_={
+                    "quantity": SalesDailyPizza.quantity + stmt.excluded.quantity,
+                    "revenue": SalesDailyPizza.revenue + stmt.excluded.revenue,
+                },
+            ))
+        self._bump_status(db, day, order.status or OrderStatus.PLACED, 1)
+
+    def record_status_change(
+        self, db: Session, *, created_at: datetime, old_status: OrderStatus, new_status: OrderStatus
+    ) -> None:
+        if old_status == new_status:
+            return
+        day = created_at.date()
+        self._bump_status(db, day, old_status, -1)
+        self._bump_status(db, day, new_status, 1)
+
+    def record_status_changes(
+        self, db: Session, *, changes: Iterable[Tuple[datetime, OrderStatus, OrderStatus]]
+    ) -> None:
+        # Batch form of record_status_change: nets the deltas per (day,
+        # status) and applies them as one multi-row upsert.
+        deltas: Dict[Tuple[date, OrderStatus], int] = defaultdict(int)
+        for created_at, old_status, new_status in changes:
+            if old_status == new_status:
+                continue
+            deltas[(created_at.date(), old_status)] -= 1
+            deltas[(created_at.date(), new_status)] += 1
+        rows = [{"day": day, "status": status, "count": delta} for (day, status), delta in deltas.items() if delta]
+        if not rows:
+            return
+        stmt = sqlite_insert(OrdersDailyStatus).values(rows)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[OrdersDailyStatus.day, OrdersDailyStatus.status],
+            set_={"count": OrdersDailyStatus.count + stmt.excluded.count},
+        ))
+
+    def rebuild(self, db: Session) -> None:
+        # Backfill from the raw tables in one transaction.
+        day = func.date(Order.created_at)
+        db.query(SalesDailyPizza).delete(synchronize_session=False)
+        db.query(OrdersDailyStatus).delete(synchronize_session=False)
+        db.execute(insert(SalesDailyPizza).from_select(
+            ["day", "pizza_id", "quantity", "revenue"],
+            select(
+                day,
+                OrderItem.pizza_id,
+                func.sum(OrderItem.quantity),
+                func.sum(OrderItem.quantity * OrderItem.unit_price - OrderItem.discount_amount),
+            ).join(Order, Order.id == OrderItem.order_id).group_by(day, OrderItem.pizza_id),
+        ))
+        db.execute(insert(OrdersDailyStatus).from_select(
+            ["day", "status", "count"],
+            select(day, Order.status, func.count()).group_by(day, Order.status),
+        ))
+        db.commit()
+
+    def get_sales(self, db: Session, *, day_from: Optional[date] = None, day_to: Optional[date] = None) -> List[SalesDailyPizza]:
+        query = db.query(SalesDailyPizza)
+        if day_from is not None:
+            query = query.filter(SalesDailyPizza.day >= day_from)
+        if day_to is not None:
+            query = query.filter(SalesDailyPizza.day <= day_to)
+        return query.order_by(SalesDailyPizza.day, SalesDailyPizza.pizza_id).all()
+
+    def get_status_counts(
+        self, db: Session, *, day_from: Optional[date] = None, day_to: Optional[date] = None
+    ) -> List[OrdersDailyStatus]:
+        query = db.query(OrdersDailyStatus).filter(OrdersDailyStatus.count != 0)
+        if day_from is not None:
+            query = query.filter(OrdersDailyStatus.day >= day_from)
+        if day_to is not None:
+            query = query.filter(OrdersDailyStatus.day <= day_to)
+        return query.order_by(OrdersDailyStatus.day, OrdersDailyStatus.status).all()
+
+rollup = CRUDRollup()
+
+# app/crud/cart.py
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session, joinedload
+from app.core.cart_store import build_cart_store
 from app.crud.base import CRUDBase
 from app.models.cart import CartItem
+from app.models.pizza import Pizza
 from app.schemas.cart import CartItemCreate, CartItemUpdate
 
 class CRUDCart(CRUDBase[CartItem, CartItemCreate, CartItemUpdate]):
-    def get_user_cart(self, db: Session, *, user_id: int) -> List[CartItem]:
-        return db.query(CartItem).filter(CartItem.user_id == user_id).all()
+    # With a store configured, carts live there and cart_items is only written
+    # by flush_carts/persist. Without one, every call goes straight to the DB.
+    # Store-backed items use the pizza id as their id, since a cart holds one
+    # row per pizza.
+    def __init__(self, model, *, load_options=(), store=None):
+        super().__init__(model, load_options=load_options)
+        self.store = store
+
+    def _db_items(self, db: Session, user_id: int) -> Dict[int, int]:
+        rows = db.query(CartItem.pizza_id, CartItem.quantity).filter(CartItem.user_id == user_id)
+        return {pizza_id: quantity for pizza_id, quantity in rows}
+
+    def _modify(self, db: Session, user_id: int, change) -> Dict[int, int]:
+        # The store runs change and save atomically (per process for the
+        # memory store, across workers for the shared one).
+        items = self.store.modify(user_id, change, lambda: self._db_items(db, user_id))
+        if self.store.flush_due():
+            # Evicted dirty carts are piling up ahead of the periodic flush.
+            self.flush_carts(db)
+        return items
+
+    def _load_items(self, db: Session, user_id: int) -> Dict[int, int]:
+        return self._modify(db, user_id, lambda items: False)
+
+    def _to_cart_items(self, db: Session, user_id: int, items: Dict[int, int], with_pizza: bool) -> List[CartItem]:
+        pizzas = {}
+        if with_pizza and items:
+            pizzas = {p.id: p for p in db.query(Pizza).filter(Pizza.id.in_(items))}
+        return [
+            CartItem(id=pizza_id, user_id=user_id, pizza_id=pizza_id, quantity=quantity, pizza=pizzas.get(pizza_id))
+            for pizza_id, quantity in items.items()
+        ]
+
+    def get_user_cart(self, db: Session, *, user_id: int, with_pizza: bool = False) -> List[CartItem]:
+        if self.store is not None:
+            return self._to_cart_items(db, user_id, self._load_items(db, user_id), with_pizza)
+        return self.query(db).filter(CartItem.user_id == user_id).all()
 
     def add_to_cart(self, db: Session, *, user_id: int, pizza_id: int, quantity: int = 1) -> CartItem:
+        if self.store is not None:
+            def add(items):
+                items[pizza_id] = items.get(pizza_id, 0) + quantity
+                return True
+
+            items = self._modify(db, user_id, add)
+            return CartItem(id=pizza_id, user_id=user_id, pizza_id=pizza_id, quantity=items[pizza_id])
+
         cart_item = db.query(CartItem).filter(
             CartItem.user_id == user_id,
             CartItem.pizza_id == pizza_id
@@ -96,7 +540,37 @@ class CRUDCart(CRUDBase[CartItem, CartItemCreate, CartItemUpdate]):
         db.refresh(cart_item)
         return cart_item
 
+    def update_item(self, db: Session, *, user_id: int, item_id: int, quantity: int) -> Optional[CartItem]:
+        if self.store is not None:
+            pizza_id = item_id
+
+            def set_quantity(items):
+                if pizza_id not in items:
+                    return False
+                items[pizza_id] = quantity
+                return True
+
+            items = self._modify(db, user_id, set_quantity)
+            if pizza_id not in items:
+                return None
+            return CartItem(id=pizza_id, user_id=user_id, pizza_id=pizza_id, quantity=quantity)
+
+        cart_item = db.query(CartItem).filter(
+            CartItem.id == item_id,
+            CartItem.user_id == user_id
+        ).first()
+        if not cart_item:
+            return None
+        cart_item.quantity = quantity
+        db.commit()
+        db.refresh(cart_item)
+        return cart_item
+
     def remove_from_cart(self, db: Session, *, user_id: int, pizza_id: int) -> None:
+        if self.store is not None:
+            self._modify(db, user_id, lambda items: items.pop(pizza_id, None) is not None)
+            return
+
         db.query(CartItem).filter(
             CartItem.user_id == user_id,
             CartItem.pizza_id == pizza_id
@@ -104,7 +578,193 @@ class CRUDCart(CRUDBase[CartItem, CartItemCreate, CartItemUpdate]):
         db.commit()
 
     def clear_cart(self, db: Session, *, user_id: int) -> None:
+        if self.store is not None:
+            self.store.clear(user_id)
         db.query(CartItem).filter(CartItem.user_id == user_id).delete()
         db.commit()
 
-cart = CRUDCart(CartItem)
\ No newline at end of file
+    def _write_carts(self, db: Session, carts: Dict[int, Dict[int, int]]) -> None:
+        db.query(CartItem).filter(CartItem.user_id.in_(carts)).delete(synchronize_session=False)
+        db.bulk_insert_mappings(CartItem, [
+            {"user_id": user_id, "pizza_id": pizza_id, "quantity": quantity}
+            for user_id, items in carts.items()
+            for pizza_id, quantity in items.items()
+        ])
+        db.commit()
+
+    def persist(self, db: Session, *, user_id: int) -> None:
+        # Checkout writes the user's cart through immediately.
+        if self.store is None:
+            return
+        items = self.store.load(user_id)
+        if items is not None:
+            self._write_carts(db, {user_id: items})
+            self.store.save(user_id, items, dirty=False)
+
+    def flush_carts(self, db: Session) -> int:
+        if self.store is None:
+            return 0
+        carts = self.store.dirty_carts()
+        if not carts:
+            return 0
+        try:
+            self._write_carts(db, {user_id: items for user_id, (items, _) in carts.items()})
+        except Exception:
+            # Nothing was marked clean, so the next flush retries these carts.
+            db.rollback()
+            raise
+        self.store.mark_clean({user_id: touched_at for user_id, (_, touched_at) in carts.items()})
+        return len(carts)
+
+cart = CRUDCart(CartItem, load_options=[joinedload(CartItem.pizza)], store=build_cart_store())
+
+# app/crud/async_user.py
+from typing import Any, Dict, Optional, Union
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.revocation import revocations
+from app.core.security import get_password_hash_async, verify_password_async
+from app.crud.async_base import AsyncCRUDBase
+from app.models.user import User
+from app.schemas.user import UserCreate, UserUpdate
+
+class AsyncCRUDUser(AsyncCRUDBase[User, UserCreate, UserUpdate]):
+    async def get_by_username(self, db: AsyncSession, *, username: str) -> Optional[User]:
+        result = await db.execute(select(User).filter(User.username == username))
+        return result.scalars().first()
+
+    async def get_by_email(self, db: AsyncSession, *, email: str) -> Optional[User]:
+        result = await db.execute(select(User).filter(User.email == email))
+        return result.scalars().first()
+
+    async def create(self, db: AsyncSession, *, obj_in: UserCreate) -> User:
+        db_obj = User(
+            username=obj_in.username,
+            email=obj_in.email,
+            hashed_password=await get_password_hash_async(obj_in.password),
+            role=obj_in.role
+        )
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def update(self, db: AsyncSession, *, db_obj: User, obj_in: Union[UserUpdate, Dict[str, Any]]) -> User:
+        if isinstance(obj_in, dict):
+            update_data = dict(obj_in)
+        else:
+            update_data = obj_in.dict(exclude_unset=True)
+        if update_data.get("password"):
+            update_data["hashed_password"] = await get_password_hash_async(update_data.pop("password"))
+        if update_data.keys() & {"hashed_password", "role", "is_active", "username"}:
+            update_data["token_version"] = (db_obj.token_version or 0) + 1
+            await db.run_sync(revocations.revoke_user, db_obj.id)
+        return await super().update(db, db_obj=db_obj, obj_in=update_data)
+
+    async def authenticate(self, db: AsyncSession, *, username: str, password: str) -> Optional[User]:
+        user = await self.get_by_username(db, username=username)
+        if not user:
+            return None
+        if not await verify_password_async(password, user.hashed_password):
+            return None
+        return user
+
+async_user = AsyncCRUDUser(User)
+
+# app/crud/async_order.py
+from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from app.crud.async_base import AsyncCRUDBase
+from app.crud.order import build_order, detach_order, insert_order_items, order_items_query, order_pizza_query
+from app.crud.rollup import rollup
+from app.models.order import Order
+from app.schemas.order import OrderCreate, OrderUpdate
+
+class AsyncCRUDOrder(AsyncCRUDBase[Order, OrderCreate, OrderUpdate]):
+    async def create_with_items(self, db: AsyncSession, *, obj_in: OrderCreate, user_id: int) -> Order:
+        result = await db.execute(order_pizza_query(obj_in))
+        db_obj, lines = build_order(obj_in, user_id=user_id, pizza_rows=result.all())
+        db.add(db_obj)
+        await db.flush()
+        await (await db.connection()).execute(*insert_order_items(db_obj.id, lines))
+        set_committed_value(db_obj, "order_items", (await db.scalars(order_items_query(db_obj.id))).all())
+        await db.run_sync(lambda sync_db: rollup.record_order(sync_db, order=db_obj))
+        detach_order(db, db_obj)
+        await db.commit()
+        return db_obj
+
+    async def get_user_orders(self, db: AsyncSession, *, user_id: int, skip: int = 0, limit: int = 100) -> List[Order]:
+        # Lazy loads are not available on AsyncSession, so items come in one extra SELECT.
+        result = await db.execute(
+            self.select()
+            .filter(Order.user_id == user_id)
+            .order_by(Order.created_at, Order.id)
+            .offset(skip)
+            .limit(limit)
+        )
+        return result.scalars().all()
+
+async_order = AsyncCRUDOrder(Order, load_options=[selectinload(Order.order_items)])
+
+# app/crud/async_cart.py
+from typing import List
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from app.crud.async_base import AsyncCRUDBase
+from app.models.cart import CartItem
+from app.schemas.cart import CartItemCreate, CartItemUpdate
+
+class AsyncCRUDCart(AsyncCRUDBase[CartItem, CartItemCreate, CartItemUpdate]):
+    async def get_user_cart(self, db: AsyncSession, *, user_id: int) -> List[CartItem]:
+        result = await db.execute(self.select().filter(CartItem.user_id == user_id))
+        return result.unique().scalars().all()
+
+    async def add_to_cart(self, db: AsyncSession, *, user_id: int, pizza_id: int, quantity: int = 1) -> CartItem:
+        result = await db.execute(
+            select(CartItem).filter(
+                CartItem.user_id == user_id,
+                CartItem.pizza_id == pizza_id
+            )
+        )
+        cart_item = result.scalars().first()
+
+        if cart_item:
+            cart_item.quantity += quantity
+        else:
+            cart_item = CartItem(user_id=user_id, pizza_id=pizza_id, quantity=quantity)
+            db.add(cart_item)
+
+        await db.commit()
+        await db.refresh(cart_item)
+        return cart_item
+
+    async def remove_from_cart(self, db: AsyncSession, *, user_id: int, pizza_id: int) -> None:
+        await db.execute(
+            delete(CartItem).where(
+                CartItem.user_id == user_id,
+                CartItem.pizza_id == pizza_id
+            )
+        )
+        await db.commit()
+
+    async def clear_cart(self, db: AsyncSession, *, user_id: int) -> None:
+        await db.execute(delete(CartItem).where(CartItem.user_id == user_id))
+        await db.commit()
+
+async_cart = AsyncCRUDCart(CartItem, load_options=[joinedload(CartItem.pizza)])
+
+# app/crud/__init__.py
+from .user import user
+from .pizza import pizza
+from .order import (
+    order, ORDER_TRANSITIONS, OrderItemError, OrderNotAssigned, OrderNotFound, OrderStatusConflict,
+    PizzaNotFound, PizzaUnavailable
+)
+from .cart import cart
+from .rollup import rollup
+from .async_user import async_user
+from .async_order import async_order
+from .async_cart import async_cart
@@ -0,0 +1,123 @@
+# app/database.py
+import threading
+from typing import Callable, List
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from app.core.config import settings
+
+PRODUCTION = settings.DB_PROFILE == "production"
+
+
+def _engine_options(pool_size: int) -> dict:
+    if not PRODUCTION:
+        return {}
+    return {
+        "poolclass": QueuePool,
+        "pool_size": pool_size,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_pre_ping": False,
+    }
+
+
+def _sqlite_pragmas(read_only: bool = False):
+    # WAL lets readers run alongside the single writer; synchronous=NORMAL is
+    # durable under WAL except for the last commits on power loss.
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA foreign_keys=ON",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    return apply
+
+
+engine = create_engine(
+    settings.DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    **_engine_options(settings.DB_POOL_SIZE),
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async handlers use their own engine so DB waits yield to the event loop
+# instead of blocking the worker. It is created on first use, so a deploy
+# that never hits an async route needs neither the async driver nor a
+# DATABASE_URL that async_database_url can map.
+AsyncSessionLocal = sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+_async_engine = None
+_async_engine_lock = threading.Lock()
+# Called with the async engine once it exists, e.g. to install query counters.
+_async_engine_hooks: List[Callable] = []
+
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        with _async_engine_lock:
+            if _async_engine is None:
+                async_engine = create_async_engine(settings.async_database_url)
+                if PRODUCTION:
+                    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas())
+                for hook in _async_engine_hooks:
+                    hook(async_engine)
+                _async_engine = async_engine
+    return _async_engine
+
+
+def on_async_engine(hook: Callable) -> None:
+    # Runs hook now if the async engine already exists, else when it's created.
+    with _async_engine_lock:
+        _async_engine_hooks.append(hook)
+        async_engine = _async_engine
+    if async_engine is not None:
+        hook(async_engine)
+
+if PRODUCTION:
+    event.listen(engine, "connect", _sqlite_pragmas())
+    # Separate pool of query_only connections for GET routes, so browsing
+    # never queues behind order writes for a connection.
+    read_engine = create_engine(
+        settings.DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        **_engine_options(settings.DB_READ_POOL_SIZE),
+    )
+    event.listen(read_engine, "connect", _sqlite_pragmas(read_only=True))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+else:
+    read_engine = engine
+    ReadSessionLocal = SessionLocal
+
+Base = declarative_base()
+
+READ_METHODS = {"GET", "HEAD"}
+
+
+def get_db(request: Request):
+    db = ReadSessionLocal() if request.method in READ_METHODS else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
@@ -5,27 +5,59 @@ from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
 from app import crud, models, schemas
+from app.core import security
 from app.core.config import settings
-from app.database import get_db
+from app.core.revocation import revocations
+from app.database import SessionLocal, get_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-async def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
-) -> models.User:
-    credentials_exception = HTTPException(
+def credentials_error() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str, *, token_type: str = "access", check_revoked: bool = True) -> dict:
+    # Refresh tokens are only accepted by /token/refresh, never as bearers.
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        raise credentials_error()
+    if payload.get("typ", "access") != token_type or (check_revoked and revocations.is_revoked(payload)):
+        raise credentials_error()
+    return payload
+
+async def get_current_user(
+    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
+) -> models.User | schemas.AuthenticatedUser:
+    credentials_exception = credentials_error()
+    payload = decode_token(token)
+    try:
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
+        token_data = schemas.TokenData(
+            username=username,
+            role=payload.get("role"),
+            user_id=payload.get("uid"),
+            token_version=payload.get("ver"),
+        )
+    except ValueError:
         raise credentials_exception
+
+    if settings.AUTH_CLAIMS_MODE and token_data.user_id is not None and token_data.role is not None:
+        if security.is_token_version_current(token_data.user_id, token_data.token_version):
+            return schemas.AuthenticatedUser(
+                id=token_data.user_id, username=token_data.username, role=token_data.role
+            )
+        user = crud.user.get(db, id=token_data.user_id)
+        if user is None or user.token_version != token_data.token_version:
+            raise credentials_exception
+        security.remember_token_version(user.id, user.token_version)
+        return user
+
     user = crud.user.get_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
@@ -38,6 +70,17 @@ async def get_current_active_user(
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_current_active_stream_user(token: str = Depends(oauth2_scheme)) -> models.User:
+    # For SSE and long polls: the user is resolved on a session that is closed
+    # before the handler runs, so the open response doesn't pin a pooled
+    # connection for its whole lifetime.
+    db = SessionLocal()
+    try:
+        current_user = await get_current_user(db=db, token=token)
+    finally:
+        db.close()
+    return await get_current_active_user(current_user)
+
 def get_current_active_admin(
     current_user: models.User = Depends(get_current_active_user),
 ) -> models.User:
@@ -50,4 +93,9 @@ def get_current_active_delivery_partner(
 ) -> models.User:
     if current_user.role != models.UserRole.DELIVERY_PARTNER:
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    return current_user
\ No newline at end of file
+    return current_user
+
+def get_current_active_stream_delivery_partner(
+    current_user: models.User = Depends(get_current_active_stream_user),
+) -> models.User:
+    return get_current_active_delivery_partner(current_user)
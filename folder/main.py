@@ -1,18 +1,167 @@
 # app/main.py
+import asyncio
+import importlib
+import logging
+import time
 from fastapi import FastAPI
-from app.routers import auth, admin, customer, delivery
-from app.database import engine
-from app import models
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from app.core.config import settings
 
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Pizza Delivery API")
+def flush_carts() -> int:
+    from app import crud
+    from app.database import SessionLocal
 
-app.include_router(auth.router)
-app.include_router(admin.router)
-app.include_router(customer.router)
-app.include_router(delivery.router)
+    db = SessionLocal()
+    try:
+        return crud.cart.flush_carts(db)
+    finally:
+        db.close()
 
-@app.get("/")
-async def root():
-    return {"message": "Welcome to the Pizza Delivery API"}
\ No newline at end of file
+async def flush_carts_periodically():
+    while True:
+        await asyncio.sleep(settings.CART_FLUSH_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(flush_carts)
+        except Exception:
+            logger.exception("Cart flush failed")
+
+def purge_idempotency_keys() -> int:
+    from app.core.idempotency import idempotency_store
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return idempotency_store.purge_expired(db)
+    finally:
+        db.close()
+
+async def purge_idempotency_keys_periodically():
+    while True:
+        await asyncio.sleep(settings.IDEMPOTENCY_TTL_SECONDS / 24)
+        try:
+            await run_in_threadpool(purge_idempotency_keys)
+        except Exception:
+            logger.exception("Idempotency key purge failed")
+
+def sync_revocations(compact: bool = False) -> None:
+    from app.core.revocation import revocations
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if compact:
+            revocations.compact(db)
+        revocations.sync(db)
+    finally:
+        db.close()
+
+async def sync_revocations_periodically():
+    # Picks up revocations made by other workers; compacts expired rows about
+    # once an hour.
+    compacted_at = time.monotonic()
+    while True:
+        await asyncio.sleep(settings.REVOCATION_SYNC_SECONDS)
+        compact = time.monotonic() - compacted_at >= 3600
+        try:
+            await run_in_threadpool(sync_revocations, compact)
+        except Exception:
+            logger.exception("Token revocation sync failed")
+        else:
+            if compact:
+                compacted_at = time.monotonic()
+
+def refill_dispatch_queue() -> None:
+    # Requeues lapsed leases and picks up orders made ready by other workers.
+    from app import crud
+    from app.core.dispatch import dispatch_queue
+    from app.database import SessionLocal
+
+    dispatch_queue.expire_leases()
+    db = SessionLocal()
+    try:
+        for order_id, created_at, promised_at in crud.order.get_dispatchable(db):
+            dispatch_queue.push(order_id, created_at, promised_at)
+    finally:
+        db.close()
+
+async def sweep_dispatch_queue_periodically():
+    while True:
+        try:
+            await run_in_threadpool(refill_dispatch_queue)
+        except Exception:
+            logger.exception("Dispatch sweep failed")
+        await asyncio.sleep(settings.DISPATCH_SWEEP_SECONDS)
+
+def install_instrumentation(app: FastAPI) -> None:
+    from app.core.metrics import MetricsMiddleware, instrument_engine, render_metrics
+    from app.core.query_budget import QueryBudgetMiddleware, install_query_counter
+    from app.database import engine, on_async_engine, read_engine
+
+    install_query_counter(engine)
+    install_query_counter(read_engine)
+    # Async routes (auth, the async user CRUD) run on this engine.
+    on_async_engine(lambda async_engine: install_query_counter(async_engine.sync_engine))
+    if settings.QUERY_BUDGET_DEFAULT is not None:
+        app.add_middleware(QueryBudgetMiddleware, default_budget=settings.QUERY_BUDGET_DEFAULT)
+    if settings.METRICS_ENABLED:
+        instrument_engine(engine)
+        if read_engine is not engine:
+            instrument_engine(read_engine)
+        on_async_engine(lambda async_engine: instrument_engine(async_engine.sync_engine))
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get("/metrics", include_in_schema=False)
+        def metrics():
+            return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def create_app(routers=None) -> FastAPI:
+    # Schema creation no longer happens on import: run `python -m app.cli
+    # migrate` on deploy, or leave DB_AUTO_MIGRATE on and the startup hook
+    # does it after a one-PRAGMA "already current" check. Only the router
+    # modules listed in ENABLED_ROUTERS are imported.
+    app = FastAPI(title="Pizza Delivery API")
+    install_instrumentation(app)
+    for name in routers or settings.ENABLED_ROUTERS:
+        app.include_router(importlib.import_module(f"app.routers.{name}").router)
+
+    @app.on_event("startup")
+    async def prepare_database():
+        from app import startup
+
+        if settings.DB_AUTO_MIGRATE:
+            await run_in_threadpool(startup.migrate)
+        if settings.DB_WARMUP:
+            await run_in_threadpool(startup.warmup)
+        await run_in_threadpool(sync_revocations)
+
+    @app.on_event("startup")
+    async def start_background_tasks():
+        from app import crud
+
+        app.state.background_tasks = [
+            asyncio.create_task(purge_idempotency_keys_periodically()),
+            asyncio.create_task(sweep_dispatch_queue_periodically()),
+            asyncio.create_task(sync_revocations_periodically()),
+        ]
+        if crud.cart.store is not None:
+            app.state.background_tasks.append(asyncio.create_task(flush_carts_periodically()))
+
+    @app.on_event("shutdown")
+    async def stop_background_tasks():
+        from app import crud
+
+        for task in app.state.background_tasks:
+            task.cancel()
+        if crud.cart.store is not None:
+            await run_in_threadpool(flush_carts)
+
+    @app.get("/")
+    async def root():
+        return {"message": "Welcome to the Pizza Delivery API"}
+
+    return app
+
+app = create_app()
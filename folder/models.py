@@ -17,6 +17,7 @@ class User(Base):
     hashed_password = Column(String)
     role = Column(Enum(UserRole), default=UserRole.CUSTOMER)
     is_active = Column(Boolean, default=True)
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
 
 # app/models/pizza.py
 from sqlalchemy import Column, Integer, String, Float, Boolean
@@ -32,8 +33,8 @@ class Pizza(Base):
     is_available = Column(Boolean, default=True)
 
 # app/models/order.py
-from sqlalchemy import Column, Integer, String, Float, Enum, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, Enum, ForeignKey, DateTime, Index
+from sqlalchemy.orm import relationship, synonym
 from database.database import Base
 import enum
 from datetime import datetime
@@ -41,6 +42,7 @@ from datetime import datetime
 class OrderStatus(str, enum.Enum):
     PLACED = "placed"
     PREPARING = "preparing"
+    READY_FOR_PICKUP = "ready_for_pickup"
     OUT_FOR_DELIVERY = "out_for_delivery"
     DELIVERED = "delivered"
     CANCELLED = "cancelled"
@@ -54,9 +56,26 @@ class Order(Base):
     status = Column(Enum(OrderStatus), default=OrderStatus.PLACED)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    user = relationship("User", back_populates="orders")
+    promised_at = Column(DateTime, nullable=True)
+    assigned_partner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    # Bumped by every status transition, for optimistic locking.
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Promotion discount already taken off total_amount.
+    discount_amount = Column(Float, nullable=False, default=0, server_default="0")
+
+    user = relationship("User", back_populates="orders", foreign_keys=[user_id])
     order_items = relationship("OrderItem", back_populates="order")
+    items = synonym("order_items")
+
+    __table_args__ = (
+        Index("ix_orders_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_orders_created_at_id", "created_at", "id"),
+        Index("ix_orders_dispatch", "status", "lease_expires_at"),
+        # Admin order search: status + created_at range, and amount range/sort.
+        Index("ix_orders_status_created_id", "status", "created_at", "id"),
+        Index("ix_orders_total_amount_id", "total_amount", "id"),
+    )
 
 class OrderItem(Base):
     __tablename__ = "order_items"
@@ -66,6 +85,9 @@ class OrderItem(Base):
     pizza_id = Column(Integer, ForeignKey("pizzas.id"))
     quantity = Column(Integer)
     unit_price = Column(Float)
+    # This line's share of the order's discount; revenue is
+    # quantity * unit_price - discount_amount.
+    discount_amount = Column(Float, nullable=False, default=0, server_default="0")
 
     order = relationship("Order", back_populates="order_items")
     pizza = relationship("Pizza")
@@ -84,4 +106,59 @@ class CartItem(Base):
     quantity = Column(Integer, default=1)
 
     user = relationship("User", back_populates="cart_items")
-    pizza = relationship("Pizza")
\ No newline at end of file
+    pizza = relationship("Pizza")
+
+# app/models/idempotency.py
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from app.database import Base
+from datetime import datetime
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    # NULL until the first request finishes; other workers wait on it meanwhile.
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    # Lease of the worker processing a pending key.
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+# app/models/rollup.py
+from sqlalchemy import Column, Integer, Float, Date, Enum, ForeignKey
+from app.database import Base
+from app.models.order import OrderStatus
+
+class SalesDailyPizza(Base):
+    __tablename__ = "sales_daily_pizza"
+
+    day = Column(Date, primary_key=True)
+    pizza_id = Column(Integer, ForeignKey("pizzas.id"), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class OrdersDailyStatus(Base):
+    __tablename__ = "orders_daily_status"
+
+    # Orders created on `day` that are currently in `status`.
+    day = Column(Date, primary_key=True)
+    status = Column(Enum(OrderStatus), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# app/models/revoked_token.py
+from sqlalchemy import Column, Integer, String, DateTime
+from app.database import Base
+from datetime import datetime
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    # A token's jti, or "user:<id>" for "every token of this user issued
+    # before revoked_at".
+    jti = Column(String, primary_key=True)
+    user_id = Column(Integer, nullable=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # Once every token this row could match has expired it is compacted away.
+    expires_at = Column(DateTime, index=True)
@@ -1,57 +1,217 @@
 # app/routers/auth.py
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import crud, models, schemas
 from app.core import security
 from app.core.config import settings
-from app.database import get_db
+from app.core.rate_limit import (
+    RateLimited, login_by_client, login_by_username, rate_limiter, signup_by_client
+)
+from app.core.revocation import revocations
+from app.database import get_async_db
+from app.dependencies import credentials_error, decode_token, oauth2_scheme
 
 router = APIRouter(tags=["authentication"])
 
+def _client_address(request: Request) -> str | None:
+    # Behind a trusted proxy the peer is the proxy: walk X-Forwarded-For from
+    # the nearest hop and take the first address that isn't one of ours.
+    address = request.client.host if request.client else None
+    if address in settings.TRUSTED_PROXIES:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            address = hop
+            if hop not in settings.TRUSTED_PROXIES:
+                break
+    return address
+
+def _throttle(*limits) -> None:
+    # Runs before any password hashing, so rejected attempts cost no bcrypt.
+    try:
+        rate_limiter.check(*limits)
+    except RateLimited as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, retry later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
 @router.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
-    db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    form_data: OAuth2PasswordRequestForm = Depends()
 ):
-    user = crud.user.authenticate(
-        db, username=form_data.username, password=form_data.password
+    _throttle(
+        (login_by_username, form_data.username.lower()),
+        (login_by_client, _client_address(request)),
     )
+    try:
+        user = await crud.async_user.authenticate(
+            db, username=form_data.username, password=form_data.password
+        )
+    except security.PasswordHashPoolFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service busy, retry shortly",
+            headers={"Retry-After": "1"},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    return _issue_tokens(user)
+
+def _issue_tokens(user: models.User) -> dict:
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = security.create_access_token(
-        user.username, expires_delta=access_token_expires
+    access_token = security.create_user_access_token(
+        user, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": security.create_refresh_token(user),
+    }
+
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(body: schemas.RefreshTokenRequest, db: AsyncSession = Depends(get_async_db)):
+    # Rotates the refresh token: no password check and no bcrypt, but the
+    # user must still exist, be active and hold the same token version.
+    claims = decode_token(body.refresh_token, token_type="refresh", check_revoked=False)
+    user = await crud.async_user.get(db, id=claims.get("uid"))
+    if (
+        user is None or not user.is_active or user.token_version != claims.get("ver")
+        or not claims.get("jti") or revocations.is_user_revoked(claims)
+    ):
+        raise credentials_error()
+    if not await db.run_sync(revocations.redeem, claims):
+        # A refresh token presented twice has leaked (or was replayed after
+        # logout), so end every session the user has. The rollback expired
+        # user, so take the id from the claims.
+        await db.run_sync(revocations.revoke_user, claims["uid"])
+        raise credentials_error()
+    return _issue_tokens(user)
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    body: schemas.LogoutRequest | None = None,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    await db.run_sync(revocations.revoke_claims, decode_token(token))
+    if body is not None and body.refresh_token:
+        await db.run_sync(revocations.revoke_claims, decode_token(body.refresh_token, token_type="refresh"))
 
 @router.post("/users", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.user.get_by_username(db, username=user.username)
+async def create_user(
+    request: Request, user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)
+):
+    _throttle((signup_by_client, _client_address(request)))
+    db_user = await crud.async_user.get_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.user.create(db=db, obj_in=user)
+    try:
+        return await crud.async_user.create(db=db, obj_in=user)
+    except security.PasswordHashPoolFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Registration service busy, retry shortly",
+            headers={"Retry-After": "1"},
+        )
 
 # app/routers/admin.py
-from fastapi import APIRouter, Depends, HTTPException
+import csv
+import io
+import json
+from collections import deque
+from datetime import date, datetime
+from typing import AsyncIterator, Iterator, Literal, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from app import crud, models, schemas
-from app.database import get_db
+from app.core.config import settings
+from app.core.menu_cache import menu_cache
+from app.core.order_hooks import order_status_changed
+from app.crud.base import Filter, Sort
+from app.database import ReadSessionLocal, get_db
 from app.dependencies import get_current_active_admin
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
+ORDER_EXPORT_FIELDS = [
+    "order_id", "user_id", "status", "total_amount", "created_at", "updated_at",
+    "order_item_id", "pizza_id", "quantity", "unit_price", "discount_amount",
+]
+
+MAX_REPORTED_IMPORT_ERRORS = 1000
+
+async def _iter_lines(request: Request) -> AsyncIterator[Tuple[int, str]]:
+    buffer = b""
+    line_no = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.decode("utf-8").rstrip("\r")
+    if buffer:
+        yield line_no + 1, buffer.decode("utf-8").rstrip("\r")
+
+async def _iter_import_rows(request: Request) -> AsyncIterator[Tuple[int, object]]:
+    content_type = request.headers.get("content-type", "")
+    lines = _iter_lines(request)
+    if "csv" in content_type:
+        # One reader for the whole body, fed a record's lines at a time. A
+        # record is complete once its quotes balance, so quoted fields may
+        # span lines.
+        pending = deque()
+        reader = csv.reader(iter(pending.popleft, None))
+        header = None
+        record, record_no, quotes = [], 0, 0
+        async for line_no, line in lines:
+            if not record and not line.strip():
+                continue
+            if not record:
+                record_no = line_no
+            record.append(line)
+            quotes += line.count('"')
+            if quotes % 2:
+                continue
+            pending.extend(part + "\n" for part in record)
+            record, quotes = [], 0
+            values = next(reader)
+            if header is None:
+                header = values
+                continue
+            yield record_no, {key: value for key, value in zip(header, values) if value != ""}
+        if record:
+            yield record_no, ValueError("Unterminated quoted field")
+    else:
+        async for line_no, line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as exc:
+                yield line_no, exc
+
 @router.post("/pizzas", response_model=schemas.Pizza)
 def create_pizza(
     pizza: schemas.PizzaCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_admin)
 ):
-    return crud.pizza.create(db=db, obj_in=pizza)
+    db_pizza = crud.pizza.create(db=db, obj_in=pizza)
+    menu_cache.bump()
+    return db_pizza
 
 @router.put("/pizzas/{pizza_id}", response_model=schemas.Pizza)
 def update_pizza(
@@ -63,7 +223,9 @@ def update_pizza(
     db_pizza = crud.pizza.get(db=db, id=pizza_id)
     if not db_pizza:
         raise HTTPException(status_code=404, detail="Pizza not found")
-    return crud.pizza.update(db=db, db_obj=db_pizza, obj_in=pizza)
+    db_pizza = crud.pizza.update(db=db, db_obj=db_pizza, obj_in=pizza)
+    menu_cache.bump()
+    return db_pizza
 
 @router.delete("/pizzas/{pizza_id}", response_model=schemas.Pizza)
 def delete_pizza(
@@ -74,7 +236,226 @@ def delete_pizza(
     db_pizza = crud.pizza.get(db=db, id=pizza_id)
     if not db_pizza:
         raise HTTPException(status_code=404, detail="Pizza not found")
-    return crud.pizza.remove(db=db, id=pizza_id)
+    db_pizza = crud.pizza.remove(db=db, id=pizza_id)
+    menu_cache.bump()
+    return db_pizza
+
+@router.post("/pizzas/import", response_model=schemas.PizzaImportResult)
+async def import_pizzas(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_admin)
+):
+    # Rows with an "id" update that pizza, the rest are created. The body is
+    # read line by line and written a chunk at a time, never held in full.
+    result = schemas.PizzaImportResult()
+    creates, updates = [], []
+
+    def fail(line_no: int, error: str):
+        result.failed += 1
+        if len(result.errors) < MAX_REPORTED_IMPORT_ERRORS:
+            result.errors.append(schemas.PizzaImportError(line=line_no, error=error))
+
+    async def flush():
+        nonlocal written
+        written = written or bool(creates or updates)
+        if creates:
+            result.created += await run_in_threadpool(crud.pizza.create_many, db, objs_in=[obj for _, obj in creates])
+        if updates:
+            updated = await run_in_threadpool(
+                crud.pizza.update_many, db, objs_in=[(id, obj) for _, id, obj in updates]
+            )
+            for line_no, id, _ in updates:
+                if id in updated:
+                    result.updated += 1
+                else:
+                    fail(line_no, f"Pizza with id {id} not found")
+        creates.clear()
+        updates.clear()
+
+    # Chunks commit as they go, so a failure part-way still leaves earlier
+    # chunks written: roll back the one in flight and always bump the menu.
+    written = False
+    try:
+        async for line_no, row in _iter_import_rows(request):
+            if isinstance(row, json.JSONDecodeError):
+                fail(line_no, f"Invalid JSON: {row}")
+                continue
+            if isinstance(row, Exception):
+                fail(line_no, str(row))
+                continue
+            if not isinstance(row, dict):
+                fail(line_no, "Row must be an object")
+                continue
+            try:
+                if row.get("id") is not None:
+                    pizza_id = int(row.pop("id"))
+                    updates.append((line_no, pizza_id, schemas.PizzaUpdate(**row)))
+                else:
+                    creates.append((line_no, schemas.PizzaCreate(**row)))
+            except (ValidationError, ValueError) as exc:
+                fail(line_no, str(exc))
+                continue
+            if len(creates) + len(updates) >= settings.BULK_CHUNK_SIZE:
+                await flush()
+        await flush()
+    except UnicodeDecodeError as exc:
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=400, detail=f"Body is not valid UTF-8: {exc}")
+    except Exception:
+        await run_in_threadpool(db.rollback)
+        raise
+    finally:
+        if written:
+            menu_cache.bump()
+    return result
+
+def _export_orders(
+    fmt: str, created_from: datetime | None, created_to: datetime | None
+) -> Iterator[str]:
+    # The generator owns its session: the request-scoped one may already be
+    # closed by the time a long export is still streaming.
+    db = ReadSessionLocal()
+    try:
+        rows = crud.order.iter_export_rows(
+            db, created_from=created_from, created_to=created_to,
+            batch_size=settings.EXPORT_BATCH_SIZE
+        )
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(ORDER_EXPORT_FIELDS)
+            for row in rows:
+                writer.writerow(jsonable_encoder([row[field] for field in ORDER_EXPORT_FIELDS]))
+                if buffer.tell() >= 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for row in rows:
+                yield json.dumps(jsonable_encoder(dict(row)), separators=(",", ":")) + "\n"
+    finally:
+        db.close()
+
+@router.get("/orders/export")
+def export_orders(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    current_user: models.User = Depends(get_current_active_admin)
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_orders(format, created_from, created_to),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="orders.{format}"'},
+    )
+
+@router.get("/reports/sales", response_model=list[schemas.SalesRollup])
+def sales_report(
+    day_from: date | None = None,
+    day_to: date | None = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_admin)
+):
+    return crud.rollup.get_sales(db, day_from=day_from, day_to=day_to)
+
+@router.get("/reports/order-status", response_model=list[schemas.StatusRollup])
+def order_status_report(
+    day_from: date | None = None,
+    day_to: date | None = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_admin)
+):
+    return crud.rollup.get_status_counts(db, day_from=day_from, day_to=day_to)
+
+@router.get("/orders", response_model=list[schemas.Order])
+def search_orders(
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_admin),
+    status: list[models.OrderStatus] = Query([]),
+    user_id: int | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    min_amount: float | None = None,
+    max_amount: float | None = None,
+    sort: list[str] = Query(["-created_at"]),
+    cursor: str | None = None,
+    skip: int = Query(0, ge=0, le=10_000),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    # e.g. ?status=preparing&created_to=<now - 20 min>&sort=created_at
+    # A single sort key pages by cursor (X-Next-Cursor); skip is for
+    # multi-key sorts and is capped, since OFFSET scans every skipped row.
+    # Filtering on one status keeps created_at ordering index-ordered via
+    # ix_orders_status_created_id; with several statuses SQLite either sorts
+    # the matches in a temp B-tree or walks ix_orders_created_at_id and
+    # filters, so narrow those queries with created_from/created_to.
+    filters = []
+    if status:
+        filters.append(Filter("status", "in", status))
+    if user_id is not None:
+        filters.append(Filter("user_id", "eq", user_id))
+    if created_from is not None:
+        filters.append(Filter("created_at", "ge", created_from))
+    if created_to is not None:
+        filters.append(Filter("created_at", "lt", created_to))
+    if min_amount is not None:
+        filters.append(Filter("total_amount", "ge", min_amount))
+    if max_amount is not None:
+        filters.append(Filter("total_amount", "le", max_amount))
+    try:
+        sorts = [Sort.parse(spec) for spec in sort]
+        if len(sorts) != 1 or (skip and cursor is None):
+            return crud.order.get_multi(db, skip=skip, limit=limit, filters=filters, sort=sorts)
+        orders, next_cursor = crud.order.get_multi_keyset(
+            db, sort=sorts[0], cursor=cursor, limit=limit, filters=filters
+        )
+    except ValueError as exc:
+        # InvalidQuerySpec, or a malformed cursor
+        raise HTTPException(status_code=400, detail=str(exc))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return orders
+
+@router.post("/orders/status", response_model=schemas.OrderStatusBulkResult)
+def bulk_update_order_status(
+    body: schemas.OrderStatusBulkUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_admin)
+):
+    # Moves a batch of orders (by id or by filter) in one transaction; orders
+    # whose current status doesn't allow the move are reported, not raised.
+    limit = min(body.limit, settings.BULK_CHUNK_SIZE)
+    if body.order_ids is not None and len(body.order_ids) > settings.BULK_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BULK_CHUNK_SIZE} orders per request")
+    filters = []
+    if body.current_status:
+        filters.append(Filter("status", "in", body.current_status))
+    if body.user_id is not None:
+        filters.append(Filter("user_id", "eq", body.user_id))
+    if body.created_before is not None:
+        filters.append(Filter("created_at", "lt", body.created_before))
+    if body.order_ids is None and not filters:
+        raise HTTPException(status_code=400, detail="Give order_ids or at least one filter")
+
+    changed, unchanged = crud.order.transition_many(
+        db, status=body.status, order_ids=body.order_ids, filters=filters, limit=limit
+    )
+    for row in changed:
+        order_status_changed(row)
+    results = [schemas.OrderStatusOutcome(order_id=row.id, outcome="updated") for row in changed]
+    for order_id, current in sorted(unchanged.items()):
+        if current is None:
+            results.append(schemas.OrderStatusOutcome(order_id=order_id, outcome="not_found", detail="Order not found"))
+        else:
+            results.append(schemas.OrderStatusOutcome(
+                order_id=order_id, outcome="conflict",
+                detail=f"Cannot change order status from {current.value} to {body.status.value}",
+            ))
+    return schemas.OrderStatusBulkResult(updated=len(changed), results=results)
 
 @router.put("/orders/{order_id}/status", response_model=schemas.Order)
 def update_order_status(
@@ -83,28 +464,88 @@ def update_order_status(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_admin)
 ):
-    db_order = crud.order.get(db=db, id=order_id)
-    if not db_order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    return crud.order.update(db=db, db_obj=db_order, obj_in=status)
+    try:
+        db_order = crud.order.transition(
+            db, order_id=order_id, status=status.status, expected_version=status.version
+        )
+    except crud.OrderNotFound as exc:
+        raise HTTPException(status_code=404, detail=exc.detail)
+    except crud.OrderStatusConflict as exc:
+        raise HTTPException(status_code=409, detail=exc.detail)
+    order_status_changed(db_order)
+    return db_order
+
+@router.post("/users/{user_id}/deactivate", response_model=schemas.User)
+def deactivate_user(
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_admin)
+):
+    # Revokes every token the user holds, effective on this worker at once
+    # and on the others within REVOCATION_SYNC_SECONDS.
+    db_user = crud.user.get(db, id=user_id)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return crud.user.update(db, db_obj=db_user, obj_in={"is_active": False})
 
 # app/routers/customer.py
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import hashlib
+import json
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app import crud, models, schemas
+from app.core.config import settings
+from app.core.idempotency import IdempotencyConflict, idempotency_store
+from app.core.menu_cache import menu_cache
+from app.core.order_events import order_events
+from app.core.pricing import pricing, to_major
+from app.core.serializers import encoder_for, fast_json_response
 from app.database import get_db
-from app.dependencies import get_current_active_user
+from app.dependencies import get_current_active_stream_user, get_current_active_user
 
 router = APIRouter(prefix="/customer", tags=["customer"])
 
 @router.get("/pizzas", response_model=list[schemas.Pizza])
 def get_pizzas(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user),
-    skip: int = 0,
-    limit: int = 100
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    cursor: str | None = None
 ):
-    return crud.pizza.get_multi(db, skip=skip, limit=limit)
+    # The first page is the same under both schemes, so it always hands out a
+    # cursor; skip is only honoured for clients still paging by offset.
+    # Clamping limit keeps clients from minting a cache entry per value.
+    limit = min(limit, settings.MENU_PAGE_MAX_LIMIT)
+    keyset = cursor is not None or skip == 0
+    cache_key = ("after", cursor, limit) if keyset else ("offset", skip, limit)
+    cached = menu_cache.get(cache_key)
+    if cached is None:
+        version = menu_cache.version
+        next_cursor = None
+        if keyset:
+            try:
+                pizzas, next_cursor = crud.pizza.get_multi_after(db, cursor=cursor, limit=limit)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        else:
+            pizzas = crud.pizza.get_multi(db, skip=skip, limit=limit)
+        if settings.FAST_SERIALIZER:
+            payload = [encoder_for(schemas.Pizza).to_python(p) for p in pizzas]
+        else:
+            payload = jsonable_encoder([schemas.Pizza.from_orm(p) for p in pizzas])
+        cached = menu_cache.put(version, cache_key, payload, next_cursor)
+    etag, body, next_cursor = cached
+    headers = {"ETag": etag}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.post("/cart/add", response_model=schemas.CartItem)
 def add_to_cart(
@@ -123,36 +564,191 @@ def remove_from_cart(
     crud.cart.remove_from_cart(db, user_id=current_user.id, pizza_id=pizza_id)
     return {"message": "Item removed from cart"}
 
+@router.put("/cart/{item_id}", response_model=schemas.CartItem)
+def update_cart(
+    item_id: int,
+    item: schemas.CartItemUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    cart_item = crud.cart.update_item(db, user_id=current_user.id, item_id=item_id, quantity=item.quantity)
+    if not cart_item:
+        raise HTTPException(status_code=404, detail="Item not found in cart")
+    return cart_item
+
 @router.get("/cart", response_model=list[schemas.CartItem])
 def get_cart(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    return crud.cart.get_user_cart(db, user_id=current_user.id)
+    items = crud.cart.get_user_cart(db, user_id=current_user.id)
+    if settings.FAST_SERIALIZER:
+        return fast_json_response(schemas.CartItem, items, many=True)
+    return items
+
+@router.post("/quote", response_model=schemas.Quote)
+def quote(
+    body: schemas.QuoteRequest | None = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    # Prices come from the engine's in-memory table, so quoting costs no
+    # pizza queries however many lines there are.
+    if body is None or body.items is None:
+        items = [
+            (item.pizza_id, item.quantity) for item in crud.cart.get_user_cart(db, user_id=current_user.id)
+        ]
+    else:
+        items = [(item.pizza_id, item.quantity) for item in body.items]
+    try:
+        result = pricing.quote(items, pricing.prices(db))
+    except crud.PizzaNotFound as exc:
+        raise HTTPException(status_code=404, detail=exc.detail)
+    except crud.PizzaUnavailable as exc:
+        raise HTTPException(status_code=400, detail=exc.detail)
+    return schemas.Quote(
+        lines=[
+            schemas.QuoteLine(
+                pizza_id=line.pizza_id, quantity=line.quantity,
+                unit_price=to_major(line.unit_price), line_total=to_major(line.line_total),
+            )
+            for line in result.lines
+        ],
+        subtotal=to_major(result.subtotal),
+        discounts=[schemas.QuoteDiscount(name=d.name, amount=to_major(d.amount)) for d in result.discounts],
+        total=to_major(result.total),
+    )
+
+def _create_order(db: Session, order: schemas.OrderCreate, user_id: int) -> models.Order:
+    try:
+        return crud.order.create_with_items(db, obj_in=order, user_id=user_id)
+    except crud.PizzaNotFound as exc:
+        raise HTTPException(status_code=404, detail=exc.detail)
+    except crud.PizzaUnavailable as exc:
+        raise HTTPException(status_code=400, detail=exc.detail)
+
+def _place_order(db: Session, order: schemas.OrderCreate, user_id: int) -> models.Order:
+    db_order = _create_order(db, order, user_id)
+    crud.cart.persist(db, user_id=user_id)
+    return db_order
 
 @router.post("/orders", response_model=schemas.Order)
 def create_order(
     order: schemas.OrderCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    current_user: models.User = Depends(get_current_active_user),
+    idempotency_key: str | None = Header(None)
 ):
-    return crud.order.create_with_items(db, obj_in=order, user_id=current_user.id)
+    if idempotency_key is None:
+        return _place_order(db, order, current_user.id)
+
+    key = f"{current_user.id}:{idempotency_key}"
+    request_hash = hashlib.sha256(order.json(sort_keys=True).encode()).hexdigest()
+    try:
+        stored = idempotency_store.begin(db, key, request_hash)
+    except IdempotencyConflict as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    if stored is not None:
+        return Response(
+            content=stored.body,
+            status_code=stored.status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    try:
+        db_order = _create_order(db, order, current_user.id)
+    except BaseException:
+        idempotency_store.abandon(db, key)
+        raise
+    # The order is committed, so from here the key is always completed, never
+    # abandoned: a retry must replay this order, not place a second one.
+    status_code, body = 500, json.dumps({"detail": f"Order {db_order.id} was placed"})
+    try:
+        body = json.dumps(jsonable_encoder(schemas.Order.from_orm(db_order)))
+        status_code = 200
+    finally:
+        idempotency_store.complete(db, key, request_hash, status_code, body)
+    crud.cart.persist(db, user_id=current_user.id)
+    return Response(content=body, media_type="application/json")
+
+async def _order_event_stream(request: Request, subscriber, missed):
+    def format_event(event):
+        return f"id: {event['id']}\nevent: order_status\ndata: {json.dumps(event)}\n\n"
+
+    try:
+        for event in missed:
+            yield format_event(event)
+        while not await request.is_disconnected():
+            if subscriber.overflowed and subscriber.queue.empty():
+                # Client resumes from the last id it saw and replays the gap.
+                break
+            try:
+                event = await asyncio.wait_for(
+                    subscriber.queue.get(), timeout=settings.ORDER_EVENTS_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        order_events.unsubscribe(subscriber)
+
+@router.get("/orders/events")
+async def order_status_events(
+    request: Request,
+    current_user: models.User = Depends(get_current_active_stream_user),
+    order_id: int | None = None,
+    last_event_id: int | None = Header(None)
+):
+    # Server-Sent Events replacing polling of GET /orders: one event per
+    # status change of the caller's orders (or a single order).
+    subscriber, missed = order_events.subscribe(
+        user_id=current_user.id, order_id=order_id, last_event_id=last_event_id
+    )
+    return StreamingResponse(
+        _order_event_stream(request, subscriber, missed),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.get("/orders", response_model=list[schemas.Order])
 def get_orders(
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user),
-    skip: int = 0,
-    limit: int = 100
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None
 ):
-    return crud.order.get_user_orders(db, user_id=current_user.id, skip=skip, limit=limit)
+    next_cursor = None
+    if cursor is None and skip:
+        orders = crud.order.get_user_orders(db, user_id=current_user.id, skip=skip, limit=limit)
+    else:
+        try:
+            orders, next_cursor = crud.order.get_user_orders_after(
+                db, user_id=current_user.id, cursor=cursor, limit=limit
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    if settings.FAST_SERIALIZER:
+        return fast_json_response(schemas.Order, orders, many=True, headers=headers)
+    if headers:
+        response.headers.update(headers)
+    return orders
 
 # app/routers/delivery.py
-from fastapi import APIRouter, Depends, HTTPException
+import time
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from app import crud, models, schemas
-from app.database import get_db
-from app.dependencies import get_current_active_delivery_partner
+from app.core.config import settings
+from app.core.dispatch import dispatch_queue
+from app.core.order_hooks import order_status_changed
+from app.database import SessionLocal, get_db
+from app.dependencies import get_current_active_delivery_partner, get_current_active_stream_delivery_partner
 
 router = APIRouter(prefix="/delivery", tags=["delivery"])
 
@@ -163,10 +759,55 @@ def update_order_status(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_delivery_partner)
 ):
-    db_order = crud.order.get(db=db, id=order_id)
-    if not db_order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    return crud.order.update(db=db, db_obj=db_order, obj_in=status)
+    try:
+        db_order = crud.order.transition(
+            db, order_id=order_id, status=status.status, expected_version=status.version,
+            partner_id=current_user.id
+        )
+    except crud.OrderNotFound as exc:
+        raise HTTPException(status_code=404, detail=exc.detail)
+    except crud.OrderNotAssigned as exc:
+        raise HTTPException(status_code=403, detail=exc.detail)
+    except crud.OrderStatusConflict as exc:
+        raise HTTPException(status_code=409, detail=exc.detail)
+    order_status_changed(db_order)
+    return db_order
+
+def _claim_assignment(order_id: int, partner_id: int) -> schemas.DeliveryAssignment | None:
+    # Own session per claim: the long poll must not hold a pooled connection
+    # while it waits.
+    db = SessionLocal()
+    try:
+        db_order = crud.order.claim_for_delivery(
+            db, order_id=order_id, partner_id=partner_id, lease_seconds=settings.DISPATCH_LEASE_SECONDS
+        )
+        if db_order is None:
+            return None
+        return schemas.DeliveryAssignment(order=db_order, lease_expires_at=db_order.lease_expires_at)
+    finally:
+        db.close()
+
+@router.get("/assignments/next", response_model=schemas.DeliveryAssignment)
+async def next_assignment(
+    wait: float = 0,
+    current_user: models.User = Depends(get_current_active_stream_delivery_partner)
+):
+    # Long poll: hands out the most urgent ready order under a lease, or 204
+    # once `wait` seconds pass with nothing to claim. Moving the order to
+    # out_for_delivery ends the lease; if it lapses first the order is requeued.
+    deadline = time.monotonic() + min(wait, settings.DISPATCH_MAX_WAIT_SECONDS)
+    while True:
+        order_id = dispatch_queue.pop()
+        if order_id is not None:
+            assignment = await run_in_threadpool(_claim_assignment, order_id, current_user.id)
+            if assignment is not None:
+                dispatch_queue.lease(order_id, assignment.lease_expires_at)
+                return assignment
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return Response(status_code=204)
+        await dispatch_queue.wait(remaining)
 
 @router.post("/orders/{order_id}/comment", response_model=schemas.Order)
 def add_order_comment(
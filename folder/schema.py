@@ -26,10 +26,25 @@ class User(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: str | None = None
 
 class TokenData(BaseModel):
     username: str | None = None
     role: UserRole | None = None
+    user_id: int | None = None
+    token_version: int | None = None
+
+class AuthenticatedUser(BaseModel):
+    id: int
+    username: str
+    role: UserRole
+    is_active: bool = True
 
 # app/schemas/pizza.py
 from pydantic import BaseModel
@@ -55,14 +70,24 @@ class Pizza(PizzaBase):
     class Config:
         orm_mode = True
 
+class PizzaImportError(BaseModel):
+    line: int
+    error: str
+
+class PizzaImportResult(BaseModel):
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list[PizzaImportError] = []
+
 # app/schemas/order.py
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, conint
+from datetime import date, datetime
 from app.models.order import OrderStatus
 
 class OrderItemBase(BaseModel):
     pizza_id: int
-    quantity: int
+    quantity: conint(gt=0)
 
 class OrderItemCreate(OrderItemBase):
     pass
@@ -70,6 +95,7 @@ class OrderItemCreate(OrderItemBase):
 class OrderItem(OrderItemBase):
     id: int
     unit_price: float
+    discount_amount: float = 0
 
     class Config:
         orm_mode = True
@@ -82,18 +108,80 @@ class OrderCreate(OrderBase):
 
 class OrderUpdate(BaseModel):
     status: OrderStatus
+    version: int | None = None
 
 class Order(OrderBase):
     id: int
     total_amount: float
+    discount_amount: float = 0
     status: OrderStatus
     created_at: datetime
     updated_at: datetime
+    version: int
     items: list[OrderItem]
 
     class Config:
         orm_mode = True
 
+class OrderStatusBulkUpdate(BaseModel):
+    status: OrderStatus
+    order_ids: list[int] | None = None
+    # Without order_ids, up to `limit` orders matching these are moved.
+    current_status: list[OrderStatus] = []
+    user_id: int | None = None
+    created_before: datetime | None = None
+    limit: conint(ge=1, le=500) = 500
+
+class OrderStatusOutcome(BaseModel):
+    order_id: int
+    outcome: str  # "updated", "not_found" or "conflict"
+    detail: str | None = None
+
+class OrderStatusBulkResult(BaseModel):
+    updated: int
+    results: list[OrderStatusOutcome]
+
+class SalesRollup(BaseModel):
+    day: date
+    pizza_id: int
+    quantity: int
+    revenue: float
+
+    class Config:
+        orm_mode = True
+
+class StatusRollup(BaseModel):
+    day: date
+    status: OrderStatus
+    count: int
+
+    class Config:
+        orm_mode = True
+
+class QuoteRequest(BaseModel):
+    # Omit items to quote the caller's cart.
+    items: list[OrderItemCreate] | None = None
+
+class QuoteLine(BaseModel):
+    pizza_id: int
+    quantity: int
+    unit_price: float
+    line_total: float
+
+class QuoteDiscount(BaseModel):
+    name: str
+    amount: float
+
+class Quote(BaseModel):
+    lines: list[QuoteLine]
+    subtotal: float
+    discounts: list[QuoteDiscount]
+    total: float
+
+class DeliveryAssignment(BaseModel):
+    order: Order
+    lease_expires_at: datetime
+
 # app/schemas/cart.py
 from pydantic import BaseModel
 
@@ -0,0 +1,130 @@
+# app/startup.py
+import logging
+import zlib
+
+from sqlalchemy import inspect, text
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+FINGERPRINT_TABLE = "schema_fingerprint"
+
+
+def schema_fingerprint(metadata) -> int:
+    # Stable digest of every table, column and index the models declare. It
+    # is stored in SQLite's user_version (a one-row table elsewhere), so
+    # checking "is the schema current" is one read instead of reflecting
+    # every table.
+    parts = []
+    for table in sorted(metadata.tables.values(), key=lambda t: t.name):
+        parts.append(table.name)
+        parts.extend(f"{column.name}:{column.type!r}:{column.nullable}" for column in table.columns)
+        parts.extend(sorted(f"ix:{index.name}" for index in table.indexes))
+    return zlib.crc32("|".join(parts).encode()) & 0x7FFFFFFF
+
+
+def _stored_fingerprint(conn) -> int | None:
+    if conn.dialect.name == "sqlite":
+        return conn.execute(text("PRAGMA user_version")).scalar()
+    if not inspect(conn).has_table(FINGERPRINT_TABLE):
+        return None
+    return conn.execute(text(f"SELECT fingerprint FROM {FINGERPRINT_TABLE}")).scalar()
+
+
+def _store_fingerprint(conn, fingerprint: int) -> None:
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(f"PRAGMA user_version = {fingerprint}"))
+        return
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} (fingerprint INTEGER NOT NULL)"))
+    conn.execute(text(f"DELETE FROM {FINGERPRINT_TABLE}"))
+    conn.execute(text(f"INSERT INTO {FINGERPRINT_TABLE} (fingerprint) VALUES (:fingerprint)"), {"fingerprint": fingerprint})
+
+
+def schema_is_current(engine, metadata) -> bool:
+    with engine.connect() as conn:
+        return _stored_fingerprint(conn) == schema_fingerprint(metadata)
+
+
+class SchemaMigrationError(RuntimeError):
+    pass
+
+
+def _column_ddl(conn, column) -> str:
+    quote = conn.dialect.identifier_preparer.quote
+    ddl = f"{quote(column.name)} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        default = column.server_default.arg
+        if isinstance(default, str):
+            default = "'%s'" % default.replace("'", "''")
+        else:
+            default = str(default.compile(dialect=conn.dialect))
+        ddl += f" DEFAULT {default}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    for foreign_key in column.foreign_keys:
+        target = foreign_key.column
+        ddl += f" REFERENCES {quote(target.table.name)} ({quote(target.name)})"
+    return ddl
+
+
+def _upgrade_existing_tables(conn, metadata) -> None:
+    # create_all only creates missing tables; columns and indexes added to
+    # existing tables need ALTER TABLE / CREATE INDEX here. A column SQLite
+    # can't add in place (primary key, or NOT NULL without a server default)
+    # stops the migration instead of leaving a half-upgraded schema.
+    inspector = inspect(conn)
+    quote = conn.dialect.identifier_preparer.quote
+    for table in metadata.sorted_tables:
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            if column.primary_key or (not column.nullable and column.server_default is None):
+                raise SchemaMigrationError(
+                    f"Cannot add column {table.name}.{column.name} to an existing table; "
+                    "give it a server_default or migrate it by hand"
+                )
+            conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {_column_ddl(conn, column)}"))
+            logger.info("Added column %s.%s", table.name, column.name)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def migrate(engine=None) -> bool:
+    # Returns True when DDL actually ran. Everything, including the new
+    # fingerprint, commits in one transaction, so a failed upgrade leaves the
+    # old fingerprint and is retried on the next start.
+    from app import models
+    from app.database import engine as default_engine
+
+    engine = engine or default_engine
+    metadata = models.Base.metadata
+    if schema_is_current(engine, metadata):
+        return False
+    with engine.begin() as conn:
+        metadata.create_all(bind=conn)
+        _upgrade_existing_tables(conn, metadata)
+        _store_fingerprint(conn, schema_fingerprint(metadata))
+    logger.info("Database schema created or updated")
+    return True
+
+
+def warmup() -> None:
+    # Opens pool connections up front (running the connect pragmas) so the
+    # first requests after boot don't pay for them.
+    from app.database import engine, read_engine
+
+    for pool_engine, size in ((engine, settings.DB_POOL_SIZE), (read_engine, settings.DB_READ_POOL_SIZE)):
+        connections = []
+        try:
+            for _ in range(size):
+                connection = pool_engine.connect()
+                connection.execute(text("SELECT 1"))
+                connections.append(connection)
+        finally:
+            for connection in connections:
+                connection.close()
+        if read_engine is engine:
+            break
@@ -1,6 +1,7 @@
 # api/customer.py
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from . import crud
 from .database import get_db
 from .models import Order, OrderItem, Pizza  # Ensure you have the Order and OrderItem models defined
 from .schemas import OrderCreate, Order, OrderItemCreate
@@ -12,38 +13,13 @@ router = APIRouter()
 @router.post("/orders", response_model=Order)
 async def create_order(order_create: OrderCreate, db: Session = Depends(get_db),
                        current_user: User = Depends(get_current_user)):
-    # Calculate total amount and validate pizzas
-    total_amount = 0
-    order_items = []
-
-    for item in order_create.items:
-        # Check if the pizza exists
-        db_pizza = db.query(Pizza).filter(Pizza.id == item.pizza_id).first()
-        if not db_pizza:
-            raise HTTPException(status_code=404, detail=f"Pizza with id {item.pizza_id} not found")
-
-        # Calculate the total amount
-        total_amount += db_pizza.price * item.quantity
-
-        # Create order item
-        order_item = OrderItem(
-            pizza_id=item.pizza_id,
-            quantity=item.quantity,
-            unit_price=db_pizza.price
-        )
-        order_items.append(order_item)
-
-    # Create the order
-    new_order = Order(
-        user_id=current_user.id,
-        total_amount=total_amount,
-        order_items=order_items  # This will create the relationship
-    )
-
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
-    return new_order
+    # Priced and validated by the shared pricing engine, one IN query for all lines
+    try:
+        return crud.order.create_with_items(db, obj_in=order_create, user_id=current_user.id)
+    except crud.PizzaNotFound as exc:
+        raise HTTPException(status_code=404, detail=exc.detail)
+    except crud.PizzaUnavailable as exc:
+        raise HTTPException(status_code=400, detail=exc.detail)
 
 
 @router.get("/orders", response_model=list[Order])
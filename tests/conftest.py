@@ -0,0 +1,120 @@
+import asyncio
+import os
+import tempfile
+
+# Settings are read at import time, so configure the app before importing it.
+_db_dir = tempfile.mkdtemp(prefix="pizza-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["CART_BACKEND"] = "db"
+
+import pytest
+
+CUSTOMER_ID, PARTNER_ID, ADMIN_ID = 1, 2, 3
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import startup
+    from app.main import create_app
+
+    startup.migrate()
+    return create_app()
+
+
+@pytest.fixture(scope="session")
+def seeded(app):
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        db.add_all([
+            models.User(id=CUSTOMER_ID, username="customer", email="customer@test.local",
+                        hashed_password="x", role=models.UserRole.CUSTOMER),
+            models.User(id=PARTNER_ID, username="partner", email="partner@test.local",
+                        hashed_password="x", role=models.UserRole.DELIVERY_PARTNER),
+            models.User(id=ADMIN_ID, username="admin", email="admin@test.local",
+                        hashed_password="x", role=models.UserRole.ADMIN),
+        ])
+        db.add_all([
+            models.Pizza(id=pizza_id, name=f"Pizza {pizza_id}", description="Test pizza",
+                         price=8 + pizza_id, is_available=True)
+            for pizza_id in range(1, 11)
+        ])
+        db.add_all([
+            models.CartItem(user_id=CUSTOMER_ID, pizza_id=pizza_id, quantity=pizza_id % 3 + 1)
+            for pizza_id in range(1, 9)
+        ])
+        db.commit()
+    finally:
+        db.close()
+    for _ in range(30):
+        _create_order()
+
+
+def _create_order(status=None) -> int:
+    # Through the real CRUD path, so items and rollups look like production.
+    # An order moved to another status is assigned to the delivery partner.
+    from app import crud, models, schemas
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        order = crud.order.create_with_items(
+            db,
+            obj_in=schemas.OrderCreate(
+                user_id=CUSTOMER_ID,
+                items=[{"pizza_id": pizza_id, "quantity": 2} for pizza_id in (1, 4, 7)],
+            ),
+            user_id=CUSTOMER_ID,
+        )
+        if status is not None:
+            db.query(models.Order).filter(models.Order.id == order.id).update(
+                {"status": status, "assigned_partner_id": PARTNER_ID}, synchronize_session=False
+            )
+            db.commit()
+        return order.id
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def create_order(seeded):
+    return _create_order
+
+
+@pytest.fixture(scope="session")
+def tokens(seeded):
+    from app import models
+    from app.core import security
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return {
+            user.username: security.create_user_access_token(user)
+            for user in db.query(models.User).all()
+        }
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def call(app, tokens):
+    # In-process ASGI calls on the test's own task, so the query counter set
+    # by assert_max_queries sees every statement the request issues.
+    import httpx
+
+    def call(method: str, url: str, *, as_user: str = "customer", **kwargs) -> httpx.Response:
+        async def send():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                headers = {"Authorization": f"Bearer {tokens[as_user]}"}
+                return await client.request(method, url, headers=headers, **kwargs)
+
+        return asyncio.run(send())
+
+    return call
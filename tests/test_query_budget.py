@@ -0,0 +1,84 @@
+import pytest
+
+from app import models
+from app.core.query_budget import QueryBudgetExceeded, assert_max_queries, count_queries
+
+# Statement ceilings for the hot routes: the user lookup, the route's own
+# queries and one selectin per loaded relationship. None of them may grow
+# with the number of rows returned.
+
+
+@pytest.mark.parametrize(
+    "method, url, as_user, body, budget",
+    [
+        ("GET", "/customer/pizzas?limit=10", "customer", None, 3),
+        ("GET", "/customer/cart", "customer", None, 3),
+        ("POST", "/customer/quote", "customer", None, 3),
+        ("GET", "/customer/orders?limit=20", "customer", None, 4),
+        ("GET", "/admin/orders?limit=50", "admin", None, 4),
+        ("GET", "/admin/orders?limit=50&sort=status", "admin", None, 4),
+        ("GET", "/admin/orders?limit=50&sort=status&sort=-created_at", "admin", None, 4),
+        (
+            "POST", "/customer/orders", "customer",
+            {"user_id": 1, "items": [{"pizza_id": pizza_id, "quantity": 1} for pizza_id in range(1, 9)]},
+            8,
+        ),
+    ],
+)
+def test_hot_routes_stay_within_query_budget(call, method, url, as_user, body, budget):
+    with assert_max_queries(budget):
+        response = call(method, url, as_user=as_user, json=body)
+    assert response.status_code == 200, response.text
+
+
+def test_admin_status_change_stays_within_query_budget(call, create_order):
+    order_id = create_order()
+    with assert_max_queries(8):
+        response = call("PUT", f"/admin/orders/{order_id}/status", as_user="admin", json={"status": "preparing"})
+    assert response.status_code == 200, response.text
+
+
+def test_delivery_status_change_stays_within_query_budget(call, create_order):
+    order_id = create_order(models.OrderStatus.READY_FOR_PICKUP)
+    with assert_max_queries(8):
+        response = call(
+            "PUT", f"/delivery/orders/{order_id}/status", as_user="partner", json={"status": "out_for_delivery"}
+        )
+    assert response.status_code == 200, response.text
+
+
+@pytest.mark.parametrize(
+    "url, as_user",
+    [
+        ("/customer/orders?limit={limit}", "customer"),
+        ("/admin/orders?limit={limit}", "admin"),
+    ],
+)
+def test_order_lists_issue_the_same_queries_for_any_page_size(call, url, as_user):
+    # An N+1 on order items would make the larger page cost more statements.
+    counts = []
+    for limit in (1, 25):
+        with count_queries() as counter:
+            response = call("GET", url.format(limit=limit), as_user=as_user)
+        assert response.status_code == 200, response.text
+        assert len(response.json()) == limit
+        counts.append(counter.count)
+    assert counts[0] == counts[1]
+
+
+def test_order_creation_issues_the_same_queries_for_any_line_count(call):
+    counts = []
+    for lines in (1, 8):
+        body = {"user_id": 1, "items": [{"pizza_id": pizza_id, "quantity": 1} for pizza_id in range(1, lines + 1)]}
+        with count_queries() as counter:
+            response = call("POST", "/customer/orders", json=body)
+        assert response.status_code == 200, response.text
+        assert len(response.json()["items"]) == lines
+        counts.append(counter.count)
+    assert counts[0] == counts[1]
+
+
+def test_assert_max_queries_fails_over_budget(call):
+    with pytest.raises(QueryBudgetExceeded):
+        with assert_max_queries(0):
+            call("GET", "/customer/orders?limit=5")
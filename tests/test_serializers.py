@@ -0,0 +1,114 @@
+import json
+from datetime import datetime
+from typing import Optional
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from app import models, schemas
+from app.core.serializers import FastEncoder, fast_json_response
+
+
+def reference_body(schema, objs) -> bytes:
+    # What the routes return without FAST_SERIALIZER: from_orm, then
+    # jsonable_encoder, then JSONResponse's json.dumps settings.
+    content = jsonable_encoder([schema.from_orm(obj) for obj in objs])
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def make_order(order_id, status, created_at, items, **fields):
+    order = models.Order(
+        id=order_id, user_id=7, total_amount=fields.pop("total_amount", 25.98), status=status,
+        created_at=created_at, updated_at=fields.pop("updated_at", created_at), version=fields.pop("version", 0),
+        discount_amount=fields.pop("discount_amount", 0.0), **fields,
+    )
+    order.order_items = [
+        models.OrderItem(
+            id=order_id * 10 + i, pizza_id=pizza_id, quantity=quantity, unit_price=unit_price, discount_amount=0.0
+        )
+        for i, (pizza_id, quantity, unit_price) in enumerate(items)
+    ]
+    return order
+
+
+PIZZAS = [
+    models.Pizza(id=1, name="Margherita", description="Tomato, mozzarella", price=9.5, is_available=True),
+    models.Pizza(id=2, name="Quattro Stagioni – “speciale”", description="Ünïcode", price=12.99, is_available=False),
+    models.Pizza(id=3, name="Whole", description="", price=10, is_available=True),
+    models.Pizza(id=4, name="Tiny", description="0.1 + 0.2", price=0.1 + 0.2, is_available=True),
+]
+
+CART_ITEMS = [
+    models.CartItem(id=1, user_id=3, pizza_id=1, quantity=1),
+    models.CartItem(id=2, user_id=3, pizza_id=2, quantity=12),
+]
+
+ORDERS = [
+    make_order(1, models.OrderStatus.PLACED, datetime(2026, 1, 2, 3, 4, 5, 678901), [(1, 2, 12.99)]),
+    make_order(
+        2, models.OrderStatus.OUT_FOR_DELIVERY, datetime(2026, 2, 1), [(1, 1, 9.5), (2, 3, 1e-7), (3, 1, 10)],
+        updated_at=datetime(2026, 2, 1, 0, 30), version=3, total_amount=22.5, discount_amount=0.3,
+    ),
+    make_order(3, models.OrderStatus.CANCELLED, datetime(2025, 12, 31, 23, 59, 59), []),
+]
+
+
+@pytest.mark.parametrize(
+    "schema, objs",
+    [
+        (schemas.Pizza, PIZZAS),
+        (schemas.CartItem, CART_ITEMS),
+        (schemas.Order, ORDERS),
+        (schemas.OrderItem, [item for order in ORDERS for item in order.order_items]),
+    ],
+    ids=["pizza", "cart_item", "order", "order_item"],
+)
+def test_encode_many_matches_jsonable_encoder(schema, objs):
+    assert FastEncoder(schema).encode_many(objs) == reference_body(schema, objs)
+
+
+@pytest.mark.parametrize("status", list(models.OrderStatus))
+def test_order_statuses_encode_as_values(status):
+    order = make_order(1, status, datetime(2026, 3, 4, 5, 6, 7), [(1, 1, 9.5)])
+    assert b"[" + FastEncoder(schemas.Order).encode(order) + b"]" == reference_body(schemas.Order, [order])
+
+
+class OptionalOrder(BaseModel):
+    id: int
+    status: Optional[models.OrderStatus]
+    promised_at: Optional[datetime]
+    total_amount: Optional[float]
+    items: Optional[list[schemas.OrderItem]]
+
+    class Config:
+        orm_mode = True
+
+
+@pytest.mark.parametrize(
+    "order",
+    [
+        make_order(1, None, datetime(2026, 1, 1), [], total_amount=None),
+        make_order(2, models.OrderStatus.DELIVERED, datetime(2026, 1, 1), [(1, 2, 3.25)],
+                   promised_at=datetime(2026, 1, 1, 0, 45, 0, 1)),
+    ],
+    ids=["nones", "values"],
+)
+def test_optional_fields_match_jsonable_encoder(order):
+    assert FastEncoder(OptionalOrder).encode_many([order]) == reference_body(OptionalOrder, [order])
+
+
+def test_fast_json_response_sets_body_and_headers():
+    response = fast_json_response(schemas.Order, ORDERS, many=True, headers={"X-Next-Cursor": "abc"})
+    assert response.body == reference_body(schemas.Order, ORDERS)
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["content-length"] == str(len(response.body))
+    assert response.headers["x-next-cursor"] == "abc"
+
+
+def test_unset_field_encodes_as_schema_default():
+    item = models.OrderItem(id=1, pizza_id=1, quantity=2, unit_price=4.5)
+    assert item.discount_amount is None
+    assert FastEncoder(schemas.OrderItem).to_python(item)["discount_amount"] == 0
@@ -0,0 +1,54 @@
+from app import crud, models, schemas
+from app.core.security import verify_password
+from app.database import SessionLocal
+
+
+def create_user(username: str) -> int:
+    db = SessionLocal()
+    try:
+        return crud.user.create(
+            db, obj_in=schemas.UserCreate(username=username, email=f"{username}@example.com", password="old-password")
+        ).id
+    finally:
+        db.close()
+
+
+def load_user(user_id: int) -> models.User:
+    db = SessionLocal()
+    try:
+        return crud.user.get(db, id=user_id)
+    finally:
+        db.close()
+
+
+def test_deactivation_persists(call):
+    user_id = create_user("to-deactivate")
+    response = call("POST", f"/admin/users/{user_id}/deactivate", as_user="admin")
+    assert response.status_code == 200, response.text
+    assert response.json()["is_active"] is False
+    user = load_user(user_id)
+    assert user.is_active is False
+    assert user.token_version == 1
+
+
+def test_password_change_persists(seeded):
+    user_id = create_user("changes-password")
+    db = SessionLocal()
+    try:
+        updated = crud.user.update(db, db_obj=crud.user.get(db, id=user_id), obj_in={"password": "new-password"})
+        assert verify_password("new-password", updated.hashed_password)
+    finally:
+        db.close()
+    user = load_user(user_id)
+    assert verify_password("new-password", user.hashed_password)
+    assert user.token_version == 1
+
+
+def test_bump_token_version_persists(seeded):
+    user_id = create_user("bumps-version")
+    db = SessionLocal()
+    try:
+        crud.user.bump_token_version(db, db_obj=crud.user.get(db, id=user_id))
+    finally:
+        db.close()
+    assert load_user(user_id).token_version == 1